@@ -11,6 +11,7 @@ from datetime import datetime
 # 内部モジュール
 from src.core.config_loader import load_config
 from src.database.connection import DatabaseConnection
+from src.database.repositories import RepositoryFactory
 from src.api.routes import devices, analytics, heatmap, reports, trajectories, dwell_time, flow, realtime
 from src.api.websocket import ConnectionManager
 
@@ -35,15 +36,23 @@ async def lifespan(app: FastAPI):
     await db_conn.connect()
     app.state.db = db_conn
     
+    # バックグラウンド処理用リポジトリファクトリ（接続プールを共有）
+    app.state.repo_factory = RepositoryFactory(db_conn)
+    
     # WebSocket接続マネージャー
     app.state.ws_manager = ConnectionManager()
     
+    # レポート生成ワーカー
+    await reports.start_report_workers(config)
+    
     logger.info("FastAPI application started successfully")
     
     yield
     
     # 終了時の処理
     logger.info("Shutting down FastAPI application...")
+    await reports.stop_report_workers()
+    await realtime.stop_scheduler()
     await db_conn.disconnect()
     logger.info("FastAPI application shut down")
 
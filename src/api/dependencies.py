@@ -12,7 +12,8 @@ from src.database.repositories import (
     HeatmapRepository,
     AnalyticsRepository,
     AlertRepository,
-    ReportRepository
+    ReportRepository,
+    RepositoryFactory
 )
 
 
@@ -82,6 +83,11 @@ def get_report_repository(
     return ReportRepository(session)
 
 
+async def get_repository_factory(request: Request) -> RepositoryFactory:
+    """バックグラウンド処理用のリポジトリファクトリを取得"""
+    return request.app.state.repo_factory
+
+
 async def get_config(request: Request) -> dict:
     """設定を取得"""
     return request.app.state.config
@@ -1,15 +1,17 @@
 """ヒートマップ関連のAPIルート"""
 from fastapi import APIRouter, HTTPException, Query, Depends
-from fastapi.responses import FileResponse
-from typing import Optional, List, Dict
+from fastapi.responses import FileResponse, Response
+from typing import Optional, List, Dict, Literal
 from datetime import datetime, timedelta
 from collections import defaultdict
+import base64
 import os
 import logging
 import numpy as np
+import orjson
 
 from src.api.schemas.heatmap import (
-    HeatmapRequest, HeatmapResponse, HeatmapData,
+    HeatmapRequest, HeatmapResponse,
     RealtimeHeatmap, HistoricalHeatmap, ZoneHeatmap
 )
 from src.api.dependencies import (
@@ -31,6 +33,7 @@ logger = logging.getLogger(__name__)
 @router.post("/generate", response_model=HeatmapResponse)
 async def generate_heatmap(
     request: HeatmapRequest,
+    encoding: Literal["float", "uint8"] = Query("float"),
     heatmap_repo: HeatmapRepository = Depends(get_heatmap_repository),
     config: dict = Depends(get_config)
 ):
@@ -39,6 +42,7 @@ async def generate_heatmap(
     
     Args:
         request: ヒートマップ生成リクエスト
+        encoding: 密度行列の形式（float: 数値の2次元配列、uint8: 8bit量子化したbase64文字列）
     """
     try:
         # ヒートマップ生成器を初期化
@@ -77,23 +81,57 @@ async def generate_heatmap(
             "coverage": float(np.count_nonzero(grid) / grid.size)
         }
         
-        return HeatmapResponse(
-            data=HeatmapData(
-                grid_size=(grid_width, grid_height),
-                resolution=resolution,
-                data=grid.tolist(),
-                max_value=statistics["max_density"],
-                min_value=statistics["min_density"],
-                timestamp=end_time
-            ),
-            image_url=None,  # 画像生成は別途実装
-            statistics=statistics
+        # 密度行列はサーバー側で生成した信頼済みデータのため、要素ごとの
+        # Pydantic検証とリスト変換を省略し、ndarrayのままorjsonでシリアライズする
+        payload = {
+            "data": {
+                "grid_size": (grid_width, grid_height),
+                "resolution": resolution,
+                "data": grid,
+                "max_value": statistics["max_density"],
+                "min_value": statistics["min_density"],
+                "timestamp": end_time
+            },
+            "image_url": None,  # 画像生成は別途実装
+            "statistics": statistics
+        }
+        if encoding == "uint8":
+            payload["data"]["encoding"] = "uint8"
+            payload["data"]["data"] = _quantize_grid(
+                grid, statistics["min_density"], statistics["max_density"]
+            )
+        return Response(
+            content=orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY),
+            media_type="application/json"
         )
     except Exception as e:
         logger.error(f"Error generating heatmap: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _quantize_grid(grid: np.ndarray, min_value: float, max_value: float) -> str:
+    """
+    密度行列を256段階に量子化してbase64文字列に変換
+    
+    表示は256色で行うため精度を落としても見た目は変わらない。
+    クライアント側では value = min + q / 255 * (max - min) で復元する（行優先、高さ×幅）
+    
+    Args:
+        grid: 密度行列
+        min_value: 最小値
+        max_value: 最大値
+        
+    Returns:
+        uint8配列のbase64文字列
+    """
+    span = max_value - min_value
+    if span > 0:
+        quantized = np.rint((grid - min_value) * (255.0 / span)).astype(np.uint8)
+    else:
+        quantized = np.zeros(grid.shape, dtype=np.uint8)
+    return base64.b64encode(quantized.tobytes()).decode('ascii')
+
+
 @router.get("/realtime", response_model=RealtimeHeatmap)
 async def get_realtime_heatmap(
     device_repo: DeviceRepository = Depends(get_device_repository),
@@ -1,22 +1,34 @@
 """リアルタイムWebSocketエンドポイント"""
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 import asyncio
+import heapq
 import json
 import logging
 from datetime import datetime
-from typing import Set, Dict
+from typing import Set, Dict, Iterable, Optional
 
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# 高頻度の制御メッセージは事前にシリアライズしておき、タイムスタンプのみ差し込む
+_PONG_PREFIX = '{"type":"pong","timestamp":"'
+_INVALID_JSON_PREFIX = '{"type":"error","message":"Invalid JSON","timestamp":"'
+_MESSAGE_SUFFIX = '"}'
+
 
 class RealtimeManager:
     """リアルタイムデータ管理"""
     
+    # 同時送信数の上限（カーネルバッファへの無制限なフレーム滞留を防ぐ）
+    MAX_CONCURRENT_SENDS = 64
+    
     def __init__(self):
         self.active_connections: Set[WebSocket] = set()
         self.subscriptions: Dict[WebSocket, Set[str]] = {}
+        # チャンネル → 購読者の逆引きインデックス（購読者がいなくなったチャンネルは削除する）
+        self.channel_subscribers: Dict[str, Set[WebSocket]] = {}
+        self._send_semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_SENDS)
     
     async def connect(self, websocket: WebSocket):
         """WebSocket接続を受け入れる"""
@@ -28,24 +40,44 @@ class RealtimeManager:
     def disconnect(self, websocket: WebSocket):
         """WebSocket接続を切断"""
         self.active_connections.discard(websocket)
-        self.subscriptions.pop(websocket, None)
+        for channel in self.subscriptions.pop(websocket, set()):
+            self._remove_subscriber(channel, websocket)
         logger.info(f"Client disconnected. Total: {len(self.active_connections)}")
     
-    async def subscribe(self, websocket: WebSocket, channel: str):
-        """チャンネルを購読"""
+    def _remove_subscriber(self, channel: str, websocket: WebSocket):
+        """逆引きインデックスから購読者を除く（空になったチャンネルは削除）"""
+        subscribers = self.channel_subscribers.get(channel)
+        if subscribers is not None:
+            subscribers.discard(websocket)
+            if not subscribers:
+                del self.channel_subscribers[channel]
+    
+    async def subscribe(self, websocket: WebSocket, channel: str) -> bool:
+        """チャンネルを購読（購読できたかどうかを返す）"""
+        if channel not in CHANNEL_INTERVALS:
+            await websocket.send_json({
+                "type": "error",
+                "message": f"Unknown channel: {channel}",
+                "timestamp": datetime.now().isoformat()
+            })
+            return False
         if websocket in self.subscriptions:
             self.subscriptions[websocket].add(channel)
+            self.channel_subscribers.setdefault(channel, set()).add(websocket)
             await websocket.send_json({
                 "type": "subscription",
                 "channel": channel,
                 "status": "subscribed",
                 "timestamp": datetime.now().isoformat()
             })
+            return True
+        return False
     
     async def unsubscribe(self, websocket: WebSocket, channel: str):
         """チャンネルの購読を解除"""
         if websocket in self.subscriptions:
             self.subscriptions[websocket].discard(channel)
+            self._remove_subscriber(channel, websocket)
             await websocket.send_json({
                 "type": "subscription",
                 "channel": channel,
@@ -53,18 +85,28 @@ class RealtimeManager:
                 "timestamp": datetime.now().isoformat()
             })
     
-    async def broadcast_to_channel(self, channel: str, data: dict):
-        """特定チャンネルの購読者にブロードキャスト"""
+    async def broadcast_to_channel(self, channel: str, data: dict,
+                                   targets: Optional[Iterable[WebSocket]] = None):
+        """特定チャンネルの購読者（targets指定時はその接続のみ）にブロードキャスト"""
+        targets = list(self.channel_subscribers.get(channel, ()) if targets is None else targets)
+        if not targets:
+            return
+        
+        # ペイロードは1回だけシリアライズして全購読者で共有
+        payload = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
         disconnected = set()
         
-        for websocket in self.active_connections:
-            if channel in self.subscriptions.get(websocket, set()):
+        async def _send(websocket: WebSocket):
+            async with self._send_semaphore:
                 try:
-                    await websocket.send_json(data)
+                    await websocket.send_text(payload)
                 except Exception as e:
                     logger.error(f"Error broadcasting: {e}")
                     disconnected.add(websocket)
         
+        # 送信を並行実行（遅いクライアントが他のクライアントの配信を塞がないようにする）
+        await asyncio.gather(*(_send(websocket) for websocket in targets))
+        
         # 切断されたクライアントを削除
         for ws in disconnected:
             self.disconnect(ws)
@@ -86,6 +128,7 @@ async def websocket_endpoint(websocket: WebSocket):
     - alerts: アラート通知
     """
     await realtime_manager.connect(websocket)
+    ensure_scheduler()
     
     try:
         while True:
@@ -98,18 +141,12 @@ async def websocket_endpoint(websocket: WebSocket):
                 
                 if msg_type == "subscribe":
                     channel = message.get("channel")
-                    if channel:
-                        await realtime_manager.subscribe(websocket, channel)
-                        
-                        # チャンネルごとの初期データを送信
-                        if channel == "positions":
-                            asyncio.create_task(send_position_updates(websocket))
-                        elif channel == "heatmap":
-                            asyncio.create_task(send_heatmap_updates(websocket))
-                        elif channel == "analytics":
-                            asyncio.create_task(send_analytics_updates(websocket))
-                        elif channel == "alerts":
-                            asyncio.create_task(send_alert_updates(websocket))
+                    if channel and await realtime_manager.subscribe(websocket, channel):
+                        # 次の定期配信を待たずに、購読した接続へ現在の状態を送る
+                        try:
+                            await PRODUCERS[channel]((websocket,))
+                        except Exception as e:
+                            logger.error(f"Error sending initial {channel} update: {e}")
                 
                 elif msg_type == "unsubscribe":
                     channel = message.get("channel")
@@ -117,10 +154,9 @@ async def websocket_endpoint(websocket: WebSocket):
                         await realtime_manager.unsubscribe(websocket, channel)
                 
                 elif msg_type == "ping":
-                    await websocket.send_json({
-                        "type": "pong",
-                        "timestamp": datetime.now().isoformat()
-                    })
+                    await websocket.send_text(
+                        _PONG_PREFIX + datetime.now().isoformat() + _MESSAGE_SUFFIX
+                    )
                 
                 else:
                     await websocket.send_json({
@@ -130,100 +166,125 @@ async def websocket_endpoint(websocket: WebSocket):
                     })
                     
             except json.JSONDecodeError:
-                await websocket.send_json({
-                    "type": "error",
-                    "message": "Invalid JSON",
-                    "timestamp": datetime.now().isoformat()
-                })
+                await websocket.send_text(
+                    _INVALID_JSON_PREFIX + datetime.now().isoformat() + _MESSAGE_SUFFIX
+                )
                 
     except WebSocketDisconnect:
         realtime_manager.disconnect(websocket)
 
 
-async def send_position_updates(websocket: WebSocket):
+# 配信メッセージの雛形（毎回のキー生成を避け、copy後に可変部分のみ差し替える）
+_POSITION_PROTO = {"type": "position_update", "channel": "positions", "data": None}
+_HEATMAP_PROTO = {"type": "heatmap_update", "channel": "heatmap", "data": None}
+_ANALYTICS_PROTO = {"type": "analytics_update", "channel": "analytics", "data": None}
+
+
+async def send_position_updates(targets: Optional[Iterable[WebSocket]] = None):
     """位置情報の更新を送信"""
-    try:
-        while websocket in realtime_manager.active_connections:
-            if "positions" in realtime_manager.subscriptions.get(websocket, set()):
-                # TODO: 実際の位置データを取得
-                data = {
-                    "type": "position_update",
-                    "channel": "positions",
-                    "data": {
-                        "devices": [],  # 実際のデバイス位置データ
-                        "total_active": 0,
-                        "timestamp": datetime.now().isoformat()
-                    }
-                }
-                await websocket.send_json(data)
-            
-            await asyncio.sleep(1)  # 1秒ごとに更新
-            
-    except Exception as e:
-        logger.error(f"Error sending position updates: {e}")
+    # TODO: 実際の位置データを取得
+    data = _POSITION_PROTO.copy()
+    data["data"] = {
+        "devices": [],  # 実際のデバイス位置データ
+        "total_active": 0,
+        "timestamp": datetime.now().isoformat()
+    }
+    await realtime_manager.broadcast_to_channel("positions", data, targets)
 
 
-async def send_heatmap_updates(websocket: WebSocket):
+async def send_heatmap_updates(targets: Optional[Iterable[WebSocket]] = None):
     """ヒートマップ更新を送信"""
-    try:
-        while websocket in realtime_manager.active_connections:
-            if "heatmap" in realtime_manager.subscriptions.get(websocket, set()):
-                # TODO: 実際のヒートマップデータを取得
-                data = {
-                    "type": "heatmap_update",
-                    "channel": "heatmap",
-                    "data": {
-                        "zones": [],  # 実際のゾーン密度データ
-                        "max_density": 0,
-                        "timestamp": datetime.now().isoformat()
-                    }
-                }
-                await websocket.send_json(data)
-            
-            await asyncio.sleep(5)  # 5秒ごとに更新
-            
-    except Exception as e:
-        logger.error(f"Error sending heatmap updates: {e}")
+    # TODO: 実際のヒートマップデータを取得
+    data = _HEATMAP_PROTO.copy()
+    data["data"] = {
+        "zones": [],  # 実際のゾーン密度データ
+        "max_density": 0,
+        "timestamp": datetime.now().isoformat()
+    }
+    await realtime_manager.broadcast_to_channel("heatmap", data, targets)
 
 
-async def send_analytics_updates(websocket: WebSocket):
+async def send_analytics_updates(targets: Optional[Iterable[WebSocket]] = None):
     """分析データ更新を送信"""
-    try:
-        while websocket in realtime_manager.active_connections:
-            if "analytics" in realtime_manager.subscriptions.get(websocket, set()):
-                # TODO: 実際の分析データを取得
-                data = {
-                    "type": "analytics_update",
-                    "channel": "analytics",
-                    "data": {
-                        "total_devices": 0,
-                        "average_dwell_time": 0,
-                        "flow_rate": 0,
-                        "busiest_zone": None,
-                        "timestamp": datetime.now().isoformat()
-                    }
-                }
-                await websocket.send_json(data)
-            
-            await asyncio.sleep(10)  # 10秒ごとに更新
-            
-    except Exception as e:
-        logger.error(f"Error sending analytics updates: {e}")
+    # TODO: 実際の分析データを取得
+    data = _ANALYTICS_PROTO.copy()
+    data["data"] = {
+        "total_devices": 0,
+        "average_dwell_time": 0,
+        "flow_rate": 0,
+        "busiest_zone": None,
+        "timestamp": datetime.now().isoformat()
+    }
+    await realtime_manager.broadcast_to_channel("analytics", data, targets)
 
 
-async def send_alert_updates(websocket: WebSocket):
+async def send_alert_updates(targets: Optional[Iterable[WebSocket]] = None):
     """アラート更新を送信"""
-    try:
-        # アラートは発生時のみ送信するため、ここでは待機
-        while websocket in realtime_manager.active_connections:
-            if "alerts" in realtime_manager.subscriptions.get(websocket, set()):
-                # TODO: 実際のアラートを監視
-                pass
-            
-            await asyncio.sleep(30)  # 30秒ごとにチェック
-            
-    except Exception as e:
-        logger.error(f"Error sending alert updates: {e}")
+    # アラートは発生時のみ送信する
+    # TODO: 実際のアラートを監視
+    pass
+
+
+# チャンネルごとの配信間隔（秒）と配信処理
+CHANNEL_INTERVALS: Dict[str, float] = {
+    "positions": 1,
+    "heatmap": 5,
+    "analytics": 10,
+    "alerts": 30
+}
+PRODUCERS = {
+    "positions": send_position_updates,
+    "heatmap": send_heatmap_updates,
+    "analytics": send_analytics_updates,
+    "alerts": send_alert_updates
+}
+
+_scheduler_task: Optional[asyncio.Task] = None
+
+
+async def _scheduler():
+    """
+    全チャンネルの配信を1つのタスクで駆動するスケジューラ
+    
+    (次回実行時刻, チャンネル)のヒープから最も早いものを待ち、
+    配信後に次回時刻を積み直す。接続・チャンネルごとにループを持たない
+    """
+    loop = asyncio.get_running_loop()
+    now = loop.time()
+    schedule = [(now, channel) for channel in CHANNEL_INTERVALS]
+    heapq.heapify(schedule)
+    
+    while True:
+        fire_time, channel = schedule[0]
+        await asyncio.sleep(max(0, fire_time - loop.time()))
+        # 処理が遅れた場合は現在時刻を基準に積み直し、遅れた分をまとめて配信しない
+        next_time = max(fire_time + CHANNEL_INTERVALS[channel], loop.time())
+        heapq.heapreplace(schedule, (next_time, channel))
+        
+        # 購読者がいないチャンネルはデータ取得・シリアライズごと省略
+        if not realtime_manager.channel_subscribers.get(channel):
+            continue
+        
+        try:
+            await PRODUCERS[channel]()
+        except Exception as e:
+            logger.error(f"Error sending {channel} updates: {e}")
+
+
+def ensure_scheduler():
+    """配信スケジューラが起動していなければ起動"""
+    global _scheduler_task
+    if _scheduler_task is None or _scheduler_task.done():
+        _scheduler_task = asyncio.create_task(_scheduler())
+
+
+async def stop_scheduler():
+    """配信スケジューラを停止"""
+    global _scheduler_task
+    if _scheduler_task is not None:
+        _scheduler_task.cancel()
+        await asyncio.gather(_scheduler_task, return_exceptions=True)
+        _scheduler_task = None
 
 
 @router.get("/status")
@@ -232,10 +293,8 @@ async def get_websocket_status():
     return {
         "active_connections": len(realtime_manager.active_connections),
         "subscriptions": {
-            "positions": sum(1 for subs in realtime_manager.subscriptions.values() if "positions" in subs),
-            "heatmap": sum(1 for subs in realtime_manager.subscriptions.values() if "heatmap" in subs),
-            "analytics": sum(1 for subs in realtime_manager.subscriptions.values() if "analytics" in subs),
-            "alerts": sum(1 for subs in realtime_manager.subscriptions.values() if "alerts" in subs)
+            channel: len(realtime_manager.channel_subscribers.get(channel, ()))
+            for channel in CHANNEL_INTERVALS
         },
         "timestamp": datetime.now().isoformat()
     }
\ No newline at end of file
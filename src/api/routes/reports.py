@@ -1,26 +1,22 @@
 """レポート関連のAPIルート"""
-from fastapi import APIRouter, HTTPException, Query, BackgroundTasks, Depends
+from fastapi import APIRouter, HTTPException, Query, Depends
 from fastapi.responses import FileResponse
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Literal
 from datetime import datetime, timedelta
 import os
+import re
+import asyncio
 import logging
 from pathlib import Path
 
 from src.api.dependencies import (
-    get_device_repository,
-    get_dwell_time_repository,
-    get_flow_repository,
-    get_analytics_repository,
     get_report_repository,
+    get_repository_factory,
     get_config
 )
 from src.database.repositories import (
-    DeviceRepository,
-    DwellTimeRepository,
-    FlowRepository,
-    AnalyticsRepository,
-    ReportRepository
+    ReportRepository,
+    RepositoryFactory
 )
 from src.api.services.report_generator import ReportGenerator
 
@@ -28,6 +24,59 @@ from src.api.services.report_generator import ReportGenerator
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# 実行時刻（HH:MM形式）の検証用パターン（モジュール読み込み時に一度だけコンパイル）
+_TIME_RE = re.compile(r"^([0-1][0-9]|2[0-3]):[0-5][0-9]$")
+
+
+# レポート生成ジョブキュー（起動時にstart_report_workersで初期化）
+REPORT_QUEUE: Optional[asyncio.Queue] = None
+_report_workers: List[asyncio.Task] = []
+
+
+async def start_report_workers(config: dict):
+    """
+    レポート生成ワーカーを起動
+    
+    固定数のワーカーが有界キューからジョブを取り出して処理するため、
+    リクエストが集中しても同時生成数とメモリ使用量に上限がかかる
+    """
+    global REPORT_QUEUE
+    
+    queue_config = config.get('reports', {}).get('queue', {})
+    REPORT_QUEUE = asyncio.Queue(maxsize=queue_config.get('max_size', 100))
+    
+    for i in range(queue_config.get('workers', 2)):
+        _report_workers.append(asyncio.create_task(_report_worker(i)))
+    
+    logger.info(f"Started {len(_report_workers)} report workers")
+
+
+async def stop_report_workers():
+    """レポート生成ワーカーを停止"""
+    for task in _report_workers:
+        task.cancel()
+    await asyncio.gather(*_report_workers, return_exceptions=True)
+    _report_workers.clear()
+
+
+async def _report_worker(worker_id: int):
+    """キューからレポート生成ジョブを取り出して順次処理"""
+    while True:
+        job = await REPORT_QUEUE.get()
+        try:
+            await _generate_report_task(**job)
+        except Exception as e:
+            logger.error(f"Report worker {worker_id} failed on {job.get('report_id')}: {e}")
+        finally:
+            REPORT_QUEUE.task_done()
+
+
+def _validate_schedule_time(time: str = Query(...)) -> str:
+    """実行時刻（HH:MM形式）を検証"""
+    if not _TIME_RE.match(time):
+        raise HTTPException(status_code=422, detail="time must be in HH:MM format")
+    return time
+
 
 @router.get("/")
 async def get_reports(
@@ -77,30 +126,27 @@ async def get_reports(
 
 @router.post("/generate")
 async def generate_report(
-    background_tasks: BackgroundTasks,
-    report_type: str = Query(..., regex="^(daily|weekly|monthly|custom)$"),
+    report_type: Literal["daily", "weekly", "monthly", "custom"] = Query(...),
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
     zones: Optional[List[str]] = Query(None),
-    format: str = Query("pdf", regex="^(pdf|excel|csv)$"),
+    format: Literal["pdf", "excel", "csv"] = Query("pdf"),
     config: dict = Depends(get_config),
-    device_repo: DeviceRepository = Depends(get_device_repository),
-    dwell_repo: DwellTimeRepository = Depends(get_dwell_time_repository),
-    flow_repo: FlowRepository = Depends(get_flow_repository),
-    analytics_repo: AnalyticsRepository = Depends(get_analytics_repository),
-    report_repo: ReportRepository = Depends(get_report_repository)
+    repo_factory: RepositoryFactory = Depends(get_repository_factory)
 ):
     """
     レポートを生成
     
     Args:
-        background_tasks: バックグラウンドタスク
         report_type: レポートタイプ
         start_date: 開始日
         end_date: 終了日
         zones: 対象ゾーン
         format: 出力フォーマット
     """
+    if REPORT_QUEUE is None:
+        raise HTTPException(status_code=503, detail="Report workers are not running")
+    
     try:
         # デフォルトの日付設定
         if not end_date:
@@ -118,29 +164,30 @@ async def generate_report(
         # レポートIDを生成
         report_id = f"{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         
-        # バックグラウンドでレポート生成を実行
-        background_tasks.add_task(
-            _generate_report_task,
-            report_id,
-            report_type,
-            start_date,
-            end_date,
-            zones,
-            format,
-            config,
-            device_repo,
-            dwell_repo,
-            flow_repo,
-            analytics_repo,
-            report_repo
-        )
+        # レポート生成ジョブをキューに投入（満杯の場合は429を返す）
+        try:
+            REPORT_QUEUE.put_nowait({
+                "report_id": report_id,
+                "report_type": report_type,
+                "start_date": start_date,
+                "end_date": end_date,
+                "zones": zones,
+                "format": format,
+                "config": config,
+                "repo_factory": repo_factory
+            })
+        except asyncio.QueueFull:
+            raise HTTPException(status_code=429, detail="Too many pending reports")
         
         return {
             "report_id": report_id,
             "status": "generating",
             "message": "レポート生成を開始しました",
-            "estimated_time": 60 if report_type == "daily" else 180  # 秒
+            "estimated_time": 60 if report_type == "daily" else 180,  # 秒
+            "queue_position": REPORT_QUEUE.qsize()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error initiating report generation: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -195,7 +242,12 @@ async def download_report(
         if not report:
             raise HTTPException(status_code=404, detail="Report not found")
         
-        if not report.file_path or not os.path.exists(report.file_path):
+        # 存在確認を兼ねて一度だけstatし、結果をFileResponseに渡す（再statを省略）
+        try:
+            stat_result = os.stat(report.file_path) if report.file_path else None
+        except OSError:
+            stat_result = None
+        if stat_result is None:
             raise HTTPException(status_code=404, detail="Report file not found")
         
         # ファイル拡張子を取得
@@ -206,10 +258,12 @@ async def download_report(
             ".csv": "text/csv"
         }.get(file_ext, "application/octet-stream")
         
+        # ASGIサーバーがzerocopysend拡張に対応していればsendfileで送出される
         return FileResponse(
             path=report.file_path,
             media_type=media_type,
-            filename=f"{report_id}{file_ext}"
+            filename=f"{report_id}{file_ext}",
+            stat_result=stat_result
         )
     except HTTPException:
         raise
@@ -276,24 +330,24 @@ async def _generate_report_task(
     zones: Optional[List[str]],
     format: str,
     config: dict,
-    device_repo: DeviceRepository,
-    dwell_repo: DwellTimeRepository,
-    flow_repo: FlowRepository,
-    analytics_repo: AnalyticsRepository,
-    report_repo: ReportRepository
+    repo_factory: RepositoryFactory
 ):
-    """バックグラウンドでレポートを生成"""
+    """
+    バックグラウンドでレポートを生成
+    
+    リポジトリはリクエスト時に注入されたものを保持せず、
+    処理段階ごとにrepo_factoryからセッションを借りて生成する
+    """
     try:
         generator = ReportGenerator(config)
         
         if report_type == "daily":
             file_path = await generator.generate_daily_report(
-                start_date, zones, device_repo, dwell_repo, flow_repo, report_repo
+                start_date, zones, repo_factory
             )
         elif report_type == "weekly":
             file_path = await generator.generate_weekly_report(
-                start_date, end_date, zones,
-                device_repo, dwell_repo, flow_repo, analytics_repo, report_repo
+                start_date, end_date, zones, repo_factory
             )
         else:
             # 月次レポートやカスタムレポートも同様に実装可能
@@ -304,14 +358,15 @@ async def _generate_report_task(
     except Exception as e:
         logger.error(f"Error generating report {report_id}: {e}")
         # エラー時はレポートステータスを更新
-        await report_repo.update(report_id, {"status": "failed"})
+        async with repo_factory.scope() as session:
+            await ReportRepository(session).update(report_id, {"status": "failed"})
 
 
 @router.post("/schedule")
 async def schedule_report(
     template_id: str,
-    schedule: str = Query(..., regex="^(daily|weekly|monthly)$"),
-    time: str = Query(..., regex="^([0-1][0-9]|2[0-3]):[0-5][0-9]$"),
+    schedule: Literal["daily", "weekly", "monthly"] = Query(...),
+    time: str = Depends(_validate_schedule_time),
     parameters: Dict = {},
     email_to: Optional[List[str]] = None
 ):
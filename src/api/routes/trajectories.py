@@ -1,7 +1,10 @@
 """軌跡関連のAPIルート"""
 from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import Response
 from typing import List, Optional, Dict
 from datetime import datetime, timedelta
+import numpy as np
+import orjson
 
 
 router = APIRouter()
@@ -49,19 +52,25 @@ async def get_device_trajectory(
         end_time: 終了時刻
     """
     # TODO: メモリ上の最新軌跡を返す（擬似データで可）
-    return {
+    now = datetime.now()
+
+    # 各点の座標・時刻をNumPyでまとめて計算（点ごとのdatetime演算を避ける）
+    i = np.arange(10, 0, -1)
+    xs = 50.0 + i * 2
+    ys = 25.0 + i * 1.5
+    timestamps = np.datetime64(now, "us") - i * np.timedelta64(1, "m")
+    zone_names = np.where(i < 10, "entrance", "main_area")
+
+    payload = {
         "device_id": device_id,
-        "trajectory_id": f"traj_{device_id}_{datetime.now().timestamp()}",
-        "start_time": datetime.now() - timedelta(minutes=30),
-        "end_time": datetime.now(),
+        "trajectory_id": f"traj_{device_id}_{now.timestamp()}",
+        "start_time": now - timedelta(minutes=30),
+        "end_time": now,
         "points": [
-            {
-                "timestamp": datetime.now() - timedelta(minutes=i),
-                "x": 50.0 + i * 2,
-                "y": 25.0 + i * 1.5,
-                "zone": "entrance" if i < 10 else "main_area"
-            }
-            for i in range(10, 0, -1)
+            {"timestamp": t, "x": x, "y": y, "zone": z}
+            for t, x, y, z in zip(
+                timestamps.tolist(), xs.tolist(), ys.tolist(), zone_names.tolist()
+            )
         ],
         "total_distance": 45.5,
         "average_speed": 1.2,
@@ -69,6 +78,12 @@ async def get_device_trajectory(
         "status": "active"
     }
 
+    # orjsonで直接バイト列にシリアライズ（jsonable_encoderを経由しない）
+    return Response(
+        content=orjson.dumps(payload),
+        media_type="application/json"
+    )
+
 
 @router.get("/{device_id}/current")
 async def get_current_position(device_id: str):
@@ -1,17 +1,26 @@
 """レポート生成サービス"""
+import asyncio
 import logging
-from typing import Dict, List, Optional
+from itertools import islice
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 from datetime import datetime, timedelta
 import json
 import os
 from pathlib import Path
+import numpy as np
 import pandas as pd
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4, landscape
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
+from reportlab.platypus import (
+    SimpleDocTemplate, Table, LongTable, TableStyle, Paragraph, Spacer, PageBreak
+)
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
+try:
+    import orjson
+except ImportError:
+    orjson = None  # orjsonがインストールされていない場合は標準jsonを使用
 
 from src.database.repositories import (
     DeviceRepository,
@@ -20,13 +29,41 @@ from src.database.repositories import (
     FlowRepository,
     HeatmapRepository,
     AnalyticsRepository,
-    ReportRepository
+    ReportRepository,
+    RepositoryFactory
 )
 
 
 class ReportGenerator:
     """レポート生成クラス"""
     
+    # データ収集時に同時実行するクエリ数の上限（接続プールを占有しないため）
+    MAX_CONCURRENT_QUERIES = 4
+    
+    # PDFスタイル（レポートごとに再構築せずクラスで共有）
+    _STYLES = getSampleStyleSheet()
+    _TITLE_STYLE = ParagraphStyle(
+        'CustomTitle',
+        parent=_STYLES['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#1f77b4'),
+        spaceAfter=30,
+        alignment=TA_CENTER
+    )
+    _ZONE_TABLE_HEADER = ["ゾーン", "訪問者数", "平均滞留時間", "最大滞留時間"]
+    _ZONE_TABLE_COL_WIDTHS = [2 * inch, 1.2 * inch, 1.5 * inch, 1.5 * inch]
+    ZONE_TABLE_CHUNK_ROWS = 100
+    _ZONE_TABLE_STYLE = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 14),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ])
+    
     def __init__(self, config: Dict):
         """
         初期化
@@ -38,15 +75,13 @@ class ReportGenerator:
         self.logger = logging.getLogger(__name__)
         self.reports_dir = Path("exports/reports")
         self.reports_dir.mkdir(parents=True, exist_ok=True)
+        self._query_semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_QUERIES)
         
     async def generate_daily_report(
         self,
         date: datetime,
         zones: Optional[List[str]],
-        device_repo: DeviceRepository,
-        dwell_repo: DwellTimeRepository,
-        flow_repo: FlowRepository,
-        report_repo: ReportRepository
+        repo_factory: RepositoryFactory
     ) -> str:
         """
         日次レポートを生成
@@ -54,7 +89,7 @@ class ReportGenerator:
         Args:
             date: レポート対象日
             zones: 対象ゾーン（Noneの場合は全ゾーン）
-            各リポジトリ
+            repo_factory: リポジトリファクトリ
             
         Returns:
             レポートファイルパス
@@ -64,29 +99,29 @@ class ReportGenerator:
             file_path = self.reports_dir / f"{report_id}.pdf"
             
             # レポートデータを収集
-            report_data = await self._collect_daily_data(
-                date, zones, device_repo, dwell_repo, flow_repo
-            )
+            report_data = await self._collect_daily_data(date, zones, repo_factory)
             
-            # PDFを生成
-            self._generate_pdf_report(
+            # PDFを生成（DB接続は保持しない、描画はイベントループを塞がないようスレッドで実行）
+            await asyncio.to_thread(
+                self._generate_pdf_report,
                 file_path,
                 f"日次レポート - {date.strftime('%Y年%m月%d日')}",
                 report_data
             )
             
             # データベースにレポート情報を保存
-            await report_repo.create_report({
-                "id": report_id,
-                "report_type": "daily",
-                "created_at": datetime.now(),
-                "period_start": date.replace(hour=0, minute=0, second=0),
-                "period_end": date.replace(hour=23, minute=59, second=59),
-                "file_path": str(file_path),
-                "file_size": file_path.stat().st_size,
-                "status": "completed",
-                "parameters": json.dumps({"zones": zones})
-            })
+            async with repo_factory.scope() as session:
+                await ReportRepository(session).create_report({
+                    "id": report_id,
+                    "report_type": "daily",
+                    "created_at": datetime.now(),
+                    "period_start": date.replace(hour=0, minute=0, second=0),
+                    "period_end": date.replace(hour=23, minute=59, second=59),
+                    "file_path": str(file_path),
+                    "file_size": file_path.stat().st_size,
+                    "status": "completed",
+                    "parameters": self._dumps({"zones": zones})
+                })
             
             self.logger.info(f"Daily report generated: {report_id}")
             return str(file_path)
@@ -100,11 +135,7 @@ class ReportGenerator:
         start_date: datetime,
         end_date: datetime,
         zones: Optional[List[str]],
-        device_repo: DeviceRepository,
-        dwell_repo: DwellTimeRepository,
-        flow_repo: FlowRepository,
-        analytics_repo: AnalyticsRepository,
-        report_repo: ReportRepository
+        repo_factory: RepositoryFactory
     ) -> str:
         """
         週次レポートを生成
@@ -113,7 +144,7 @@ class ReportGenerator:
             start_date: 開始日
             end_date: 終了日
             zones: 対象ゾーン
-            各リポジトリ
+            repo_factory: リポジトリファクトリ
             
         Returns:
             レポートファイルパス
@@ -124,29 +155,30 @@ class ReportGenerator:
             
             # レポートデータを収集
             report_data = await self._collect_weekly_data(
-                start_date, end_date, zones, 
-                device_repo, dwell_repo, flow_repo, analytics_repo
+                start_date, end_date, zones, repo_factory
             )
             
-            # PDFを生成
-            self._generate_pdf_report(
+            # PDFを生成（DB接続は保持しない、描画はイベントループを塞がないようスレッドで実行）
+            await asyncio.to_thread(
+                self._generate_pdf_report,
                 file_path,
                 f"週次レポート - {start_date.strftime('%Y/%m/%d')} ～ {end_date.strftime('%Y/%m/%d')}",
                 report_data
             )
             
             # データベースにレポート情報を保存
-            await report_repo.create_report({
-                "id": report_id,
-                "report_type": "weekly",
-                "created_at": datetime.now(),
-                "period_start": start_date,
-                "period_end": end_date,
-                "file_path": str(file_path),
-                "file_size": file_path.stat().st_size,
-                "status": "completed",
-                "parameters": json.dumps({"zones": zones})
-            })
+            async with repo_factory.scope() as session:
+                await ReportRepository(session).create_report({
+                    "id": report_id,
+                    "report_type": "weekly",
+                    "created_at": datetime.now(),
+                    "period_start": start_date,
+                    "period_end": end_date,
+                    "file_path": str(file_path),
+                    "file_size": file_path.stat().st_size,
+                    "status": "completed",
+                    "parameters": self._dumps({"zones": zones})
+                })
             
             self.logger.info(f"Weekly report generated: {report_id}")
             return str(file_path)
@@ -155,41 +187,63 @@ class ReportGenerator:
             self.logger.error(f"Error generating weekly report: {e}")
             raise
     
+    async def _query(
+        self,
+        repo_factory: RepositoryFactory,
+        repo_class: type,
+        query: Callable[[Any], Awaitable[Any]]
+    ) -> Any:
+        """
+        専用セッションでリポジトリクエリを実行
+        
+        AsyncSessionは同時実行できないため、並行させるクエリごとに
+        プールからセッションを借りる（同時数はセマフォで制限）
+        """
+        async with self._query_semaphore:
+            async with repo_factory.scope() as session:
+                return await query(repo_class(session))
+    
     async def _collect_daily_data(
         self,
         date: datetime,
         zones: Optional[List[str]],
-        device_repo: DeviceRepository,
-        dwell_repo: DwellTimeRepository,
-        flow_repo: FlowRepository
+        repo_factory: RepositoryFactory
     ) -> Dict:
         """日次データを収集"""
         
-        start_time = date.replace(hour=0, minute=0, second=0)
-        end_time = date.replace(hour=23, minute=59, second=59)
-        
-        # デバイス統計
-        active_devices = await device_repo.get_active_devices(minutes=1440)  # 24時間
-        
-        # ゾーン別滞留時間統計
-        zone_stats = {}
         zones_to_check = zones or self._get_all_zones()
         
-        for zone_id in zones_to_check:
-            stats = await dwell_repo.get_zone_statistics(zone_id, date)
-            zone_stats[zone_id] = stats
-        
-        # フロー統計
-        flow_matrix = await flow_repo.get_flow_matrix(date)
-        popular_paths = await flow_repo.get_popular_paths(limit=10)
+        # デバイス統計・フロー統計・ゾーン別滞留時間統計を並行して取得
+        total_devices, hourly_flow, popular_paths, *zone_stats_list = await asyncio.gather(
+            self._query(
+                repo_factory, DeviceRepository,
+                lambda repo: repo.count_active_devices(minutes=1440)  # 24時間
+            ),
+            self._query(
+                repo_factory, FlowRepository,
+                lambda repo: repo.get_hourly_flow_totals(date)
+            ),
+            self._query(
+                repo_factory, FlowRepository,
+                lambda repo: repo.get_popular_paths(limit=10)
+            ),
+            *(
+                self._query(
+                    repo_factory, DwellTimeRepository,
+                    lambda repo, zone_id=zone_id: repo.get_zone_statistics(zone_id, date)
+                )
+                for zone_id in zones_to_check
+            )
+        )
+        zone_stats = dict(zip(zones_to_check, zone_stats_list))
         
         return {
             "date": date,
-            "total_devices": len(active_devices),
+            "total_devices": total_devices,
             "zone_statistics": zone_stats,
-            "flow_matrix": flow_matrix,
+            "hourly_flow": hourly_flow,
             "popular_paths": popular_paths,
-            "peak_hours": self._calculate_peak_hours(flow_matrix)
+            "peak_hours": self._calculate_peak_hours(hourly_flow)
         }
     
     async def _collect_weekly_data(
@@ -197,30 +251,70 @@ class ReportGenerator:
         start_date: datetime,
         end_date: datetime,
         zones: Optional[List[str]],
-        device_repo: DeviceRepository,
-        dwell_repo: DwellTimeRepository,
-        flow_repo: FlowRepository,
-        analytics_repo: AnalyticsRepository
+        repo_factory: RepositoryFactory
     ) -> Dict:
         """週次データを収集"""
         
-        # 日別データを収集
-        daily_data = []
+        dates = []
         current_date = start_date
-        
         while current_date <= end_date:
-            day_data = await self._collect_daily_data(
-                current_date, zones, device_repo, dwell_repo, flow_repo
-            )
-            daily_data.append(day_data)
+            dates.append(current_date)
             current_date += timedelta(days=1)
         
-        # 週次サマリーを計算
-        total_devices = sum(d["total_devices"] for d in daily_data)
-        avg_daily_devices = total_devices / len(daily_data) if daily_data else 0
+        zones_to_check = zones or self._get_all_zones()
+        days = [d.replace(hour=0, minute=0, second=0, microsecond=0) for d in dates]
+        range_start = days[0] if days else start_date
+        range_end = days[-1] + timedelta(days=1) if days else start_date
+        
+        # 日ごとにクエリを繰り返さず、期間全体を日別にグループ化して一括取得する
+        # （デバイス数と人気経路は日付に依存しないため1回だけ取得して各日で共有）
+        total_devices_per_day, popular_paths, zone_stats_range, hourly_flow_range, analytics = await asyncio.gather(
+            self._query(
+                repo_factory, DeviceRepository,
+                lambda repo: repo.count_active_devices(minutes=1440)  # 24時間
+            ),
+            self._query(
+                repo_factory, FlowRepository,
+                lambda repo: repo.get_popular_paths(limit=10)
+            ),
+            self._query(
+                repo_factory, DwellTimeRepository,
+                lambda repo: repo.get_zone_statistics_range(zones_to_check, range_start, range_end)
+            ),
+            self._query(
+                repo_factory, FlowRepository,
+                lambda repo: repo.get_hourly_flow_totals_range(range_start, range_end)
+            ),
+            # 分析データを取得
+            self._query(
+                repo_factory, AnalyticsRepository,
+                lambda repo: repo.get_analytics_range(start_date, end_date)
+            )
+        )
         
-        # 分析データを取得
-        analytics = await analytics_repo.get_analytics_range(start_date, end_date)
+        # 取得結果を日別データに振り分け
+        daily_data = []
+        for date, day in zip(dates, days):
+            hourly_flow = hourly_flow_range.get(day, [])
+            daily_data.append({
+                "date": date,
+                "total_devices": total_devices_per_day,
+                "zone_statistics": {
+                    zone_id: zone_stats_range[(day, zone_id)] for zone_id in zones_to_check
+                },
+                "hourly_flow": hourly_flow,
+                "popular_paths": popular_paths,
+                "peak_hours": self._calculate_peak_hours(hourly_flow)
+            })
+        
+        # 日別デバイス数を列として取り出し、以降の集計はこの配列で行う
+        device_counts = np.fromiter(
+            (d["total_devices"] for d in daily_data), dtype=np.int64, count=len(daily_data)
+        )
+        
+        # 週次サマリーを計算
+        total_devices = int(device_counts.sum())
+        avg_daily_devices = total_devices / len(device_counts) if len(device_counts) else 0
         
         return {
             "period": f"{start_date.strftime('%Y/%m/%d')} - {end_date.strftime('%Y/%m/%d')}",
@@ -228,7 +322,7 @@ class ReportGenerator:
             "total_devices": total_devices,
             "average_daily_devices": avg_daily_devices,
             "analytics": analytics,
-            "trends": self._calculate_weekly_trends(daily_data)
+            "trends": self._calculate_weekly_trends(device_counts)
         }
     
     def _generate_pdf_report(self, file_path: Path, title: str, data: Dict):
@@ -245,15 +339,8 @@ class ReportGenerator:
         )
         
         # スタイルを取得
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor('#1f77b4'),
-            spaceAfter=30,
-            alignment=TA_CENTER
-        )
+        styles = self._STYLES
+        title_style = self._TITLE_STYLE
         
         # コンテンツリスト
         content = []
@@ -281,28 +368,25 @@ class ReportGenerator:
         if "zone_statistics" in data and data["zone_statistics"]:
             content.append(Paragraph("ゾーン別統計", styles['Heading2']))
             
-            table_data = [["ゾーン", "訪問者数", "平均滞留時間", "最大滞留時間"]]
-            for zone_id, stats in data["zone_statistics"].items():
-                table_data.append([
-                    zone_id,
-                    str(stats.get('unique_visitors', 0)),
-                    f"{stats.get('avg_duration', 0):.1f}秒",
-                    f"{stats.get('max_duration', 0):.1f}秒"
-                ])
+            # 行数が多い場合は一定行ごとに別テーブルへ分割し、レイアウト計算量を抑える
+            rows = iter(self._zone_table_rows(data["zone_statistics"]))
+            while True:
+                chunk = list(islice(rows, self.ZONE_TABLE_CHUNK_ROWS))
+                if not chunk:
+                    break
+                if isinstance(content[-1], LongTable):
+                    content.append(PageBreak())
+                
+                # 列幅を固定してセル内容による幅計算を省略
+                table = LongTable(
+                    [self._ZONE_TABLE_HEADER] + chunk,
+                    colWidths=self._ZONE_TABLE_COL_WIDTHS,
+                    repeatRows=1,
+                    splitByRow=1
+                )
+                table.setStyle(self._ZONE_TABLE_STYLE)
+                content.append(table)
             
-            table = Table(table_data)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 14),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            
-            content.append(table)
             content.append(Spacer(1, 12))
         
         # 人気経路
@@ -332,41 +416,52 @@ class ReportGenerator:
         # PDFをビルド
         doc.build(content)
     
+    def _zone_table_rows(self, zone_statistics: Dict) -> List[List[str]]:
+        """ゾーン統計テーブルの行を生成（列単位で一括フォーマット）"""
+        if not zone_statistics:
+            return []
+        
+        df = pd.DataFrame.from_dict(zone_statistics, orient='index').reindex(
+            columns=['unique_visitors', 'avg_duration', 'max_duration']
+        ).fillna(0)
+        
+        table = pd.DataFrame({
+            'zone_id': df.index.astype(str),
+            'unique_visitors': df['unique_visitors'].astype(np.int64).astype(str),
+            'avg_duration': df['avg_duration'].map('{:.1f}秒'.format),
+            'max_duration': df['max_duration'].map('{:.1f}秒'.format)
+        })
+        return table.values.tolist()
+    
+    @staticmethod
+    def _dumps(value: Any) -> str:
+        """JSON文字列にシリアライズ"""
+        if orjson is not None:
+            return orjson.dumps(value).decode()
+        return json.dumps(value)
+    
     def _get_all_zones(self) -> List[str]:
         """設定から全ゾーンIDを取得"""
         zones = self.config.get('layout', {}).get('zones', [])
         return [zone['id'] for zone in zones if 'id' in zone]
     
-    def _calculate_peak_hours(self, flow_matrix: List) -> str:
-        """ピーク時間帯を計算"""
-        if not flow_matrix:
+    def _calculate_peak_hours(self, hourly_flow: List[Dict]) -> str:
+        """ピーク時間帯を計算（時間帯別の集計済み遷移数から）"""
+        if not hourly_flow:
             return "データなし"
         
-        # 時間帯別に集計
-        hourly_counts = {}
-        for flow in flow_matrix:
-            hour = flow.hour
-            if hour not in hourly_counts:
-                hourly_counts[hour] = 0
-            hourly_counts[hour] += flow.transition_count
-        
-        if not hourly_counts:
-            return "データなし"
-        
-        # 最大の時間帯を特定
-        peak_hour = max(hourly_counts, key=hourly_counts.get)
+        # 最大の時間帯を特定（最大24行）
+        peak_hour = max(hourly_flow, key=lambda row: row['count'])['hour']
         return f"{peak_hour}:00 - {peak_hour + 1}:00"
     
-    def _calculate_weekly_trends(self, daily_data: List[Dict]) -> Dict:
-        """週次トレンドを計算"""
-        if not daily_data:
+    def _calculate_weekly_trends(self, device_counts: np.ndarray) -> Dict:
+        """週次トレンドを計算（日別デバイス数の配列から）"""
+        if not len(device_counts):
             return {}
         
-        device_counts = [d["total_devices"] for d in daily_data]
-        
         return {
-            "average": sum(device_counts) / len(device_counts),
-            "max": max(device_counts),
-            "min": min(device_counts),
+            "average": float(device_counts.mean()),
+            "max": int(device_counts.max()),
+            "min": int(device_counts.min()),
             "trend": "increasing" if device_counts[-1] > device_counts[0] else "decreasing"
-        }
\ No newline at end of file
+        }
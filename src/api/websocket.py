@@ -1,16 +1,40 @@
 """WebSocket接続管理モジュール"""
+import asyncio
 import logging
 import json
-from typing import List, Dict, Any
+from collections import defaultdict
+from typing import Set, Dict, Any
 from fastapi import WebSocket
+try:
+    import orjson
+except ImportError:
+    orjson = None  # orjsonがインストールされていない場合は標準jsonを使用
+
+
+def _dumps(message: Any) -> str:
+    """メッセージをJSON文字列にシリアライズ"""
+    if orjson is not None:
+        return orjson.dumps(message).decode()
+    return json.dumps(message, ensure_ascii=False)
 
 
 class ConnectionManager:
     """WebSocket接続マネージャー"""
     
+    # 1クライアントへの送信タイムアウト（秒）
+    SEND_TIMEOUT = 2.0
+    # クライアントごとの送信キュー上限（超過分のブロードキャストは破棄）
+    SEND_QUEUE_SIZE = 64
+    
     def __init__(self):
         """初期化"""
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Set[WebSocket] = set()
+        # グループ → 接続、接続 → グループの双方向インデックス
+        self._groups: Dict[str, Set[WebSocket]] = defaultdict(set)
+        self._ws_groups: Dict[WebSocket, Set[str]] = {}
+        # 接続ごとの送信キューと、それを排出する書き込みタスク
+        self._queues: Dict[WebSocket, asyncio.Queue] = {}
+        self._writers: Dict[WebSocket, asyncio.Task] = {}
         self.logger = logging.getLogger(__name__)
         
     async def connect(self, websocket: WebSocket):
@@ -21,7 +45,11 @@ class ConnectionManager:
             websocket: WebSocketインスタンス
         """
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections.add(websocket)
+        
+        queue = asyncio.Queue(maxsize=self.SEND_QUEUE_SIZE)
+        self._queues[websocket] = queue
+        self._writers[websocket] = asyncio.create_task(self._writer(websocket, queue))
         self.logger.info(f"WebSocket client connected. Total connections: {len(self.active_connections)}")
         
     def disconnect(self, websocket: WebSocket):
@@ -31,10 +59,42 @@ class ConnectionManager:
         Args:
             websocket: WebSocketインスタンス
         """
+        for group in self._ws_groups.pop(websocket, ()):
+            self._groups[group].discard(websocket)
+            
+        self._queues.pop(websocket, None)
+        writer = self._writers.pop(websocket, None)
+        if writer is not None and writer is not asyncio.current_task():
+            writer.cancel()
+            
         if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+            self.active_connections.discard(websocket)
             self.logger.info(f"WebSocket client disconnected. Total connections: {len(self.active_connections)}")
             
+    def subscribe(self, websocket: WebSocket, group: str):
+        """
+        接続をグループに追加
+        
+        Args:
+            websocket: WebSocketインスタンス
+            group: グループ名
+        """
+        self._groups[group].add(websocket)
+        self._ws_groups.setdefault(websocket, set()).add(group)
+        
+    def unsubscribe(self, websocket: WebSocket, group: str):
+        """
+        接続をグループから削除
+        
+        Args:
+            websocket: WebSocketインスタンス
+            group: グループ名
+        """
+        self._groups[group].discard(websocket)
+        groups = self._ws_groups.get(websocket)
+        if groups is not None:
+            groups.discard(group)
+            
     async def send_personal_message(self, message: Any, websocket: WebSocket):
         """
         特定のクライアントにメッセージを送信
@@ -43,34 +103,85 @@ class ConnectionManager:
             message: 送信するメッセージ
             websocket: 対象のWebSocket
         """
+        queue = self._queues.get(websocket)
+        if queue is None:
+            return
+            
+        if isinstance(message, dict):
+            message = _dumps(message)
+        # 個別メッセージは破棄せず、キューに空きができるまで待つ
         try:
-            if isinstance(message, dict):
-                message = json.dumps(message, ensure_ascii=False)
-            await websocket.send_text(message)
-        except Exception as e:
-            self.logger.error(f"Error sending message to client: {e}")
+            await asyncio.wait_for(queue.put(("send_text", message)), timeout=self.SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.logger.error("Error sending message to client: send queue is full")
             
     async def broadcast(self, message: Any):
         """
-        全てのクライアントにメッセージをブロードキャスト
+        全てのクライアントにメッセージをブロードキャスト（テキストフレーム）
         
         Args:
             message: ブロードキャストするメッセージ
         """
         if isinstance(message, dict):
-            message = json.dumps(message, ensure_ascii=False)
+            message = _dumps(message)
             
-        disconnected = []
-        for connection in self.active_connections:
+        await self._send_to_all(self.active_connections, "send_text", message)
+        
+    async def broadcast_raw(self, payload: bytes):
+        """
+        UTF-8エンコード済みのペイロードをバイナリフレームでブロードキャスト
+        
+        シリアライズ・エンコードを呼び出し側で1回だけ行い、
+        クライアントごとの再エンコードを省略する高速経路
+        
+        Args:
+            payload: エンコード済みペイロード
+        """
+        await self._send_to_all(self.active_connections, "send_bytes", payload)
+        
+    async def _send_to_all(self, connections, method: str, payload: Any):
+        """
+        指定の接続の送信キューへ投入（送信自体は接続ごとの書き込みタスクが行う）
+        
+        Args:
+            connections: 送信先の接続
+            method: WebSocketの送信メソッド名（send_text / send_bytes）
+            payload: 送信データ
+        """
+        # 遅いクライアントのキューが満杯でも他のクライアントを待たせない
+        dropped = 0
+        for connection in list(connections):
+            queue = self._queues.get(connection)
+            if queue is None:
+                continue
             try:
-                await connection.send_text(message)
-            except Exception as e:
-                self.logger.error(f"Error broadcasting to client: {e}")
-                disconnected.append(connection)
+                queue.put_nowait((method, payload))
+            except asyncio.QueueFull:
+                dropped += 1
                 
-        # 切断されたクライアントを削除
-        for conn in disconnected:
-            self.disconnect(conn)
+        if dropped:
+            self.logger.warning(f"Dropped broadcast for {dropped} slow client(s)")
+            
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue):
+        """
+        送信キューを順に排出してクライアントへ送信
+        
+        Args:
+            websocket: WebSocketインスタンス
+            queue: この接続の送信キュー
+        """
+        try:
+            while True:
+                method, payload = await queue.get()
+                # 応答しないクライアントはタイムアウトで打ち切る
+                await asyncio.wait_for(
+                    getattr(websocket, method)(payload), timeout=self.SEND_TIMEOUT
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"Error sending message to client: {e!r}")
+            self.disconnect(websocket)
             
     async def broadcast_to_group(self, message: Any, group: str):
         """
@@ -80,8 +191,15 @@ class ConnectionManager:
             message: ブロードキャストするメッセージ
             group: グループ名
         """
-        # グループ管理機能は必要に応じて実装
-        pass
+        connections = self._groups.get(group)
+        if not connections:
+            return
+            
+        if isinstance(message, dict):
+            message = _dumps(message)
+            
+        # グループに属する接続のみに送信
+        await self._send_to_all(connections, "send_text", message)
         
     def get_connection_count(self) -> int:
         """
@@ -1,9 +1,30 @@
 """設定ファイル読み込みモジュール"""
 import os
+import re
 import yaml
 from pathlib import Path
 from typing import Dict, Any
 from dotenv import load_dotenv
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader  # libyamlが利用できない場合
+
+
+# 環境変数参照（${VAR}）のパターン
+_ENV_RE = re.compile(r'\$\{([^}]+)\}')
+
+
+def _coerce(value: str) -> Any:
+    """環境変数から得た文字列をbool値・数値に変換"""
+    lowered = value.lower()
+    # bool値の変換
+    if lowered in ('true', 'false'):
+        return lowered == 'true'
+    # 数値の変換
+    if value.isdigit():
+        return int(value)
+    return value
 
 
 class ConfigLoader:
@@ -26,6 +47,11 @@ class ConfigLoader:
         self.config = {}
         self.layout = {}
         
+        # ドット区切りキー → 値の索引、ID → ゾーン/受信機の索引
+        self._flat: Dict[str, Any] = {}
+        self._zones_by_id: Dict[str, Dict[str, Any]] = {}
+        self._receivers_by_id: Dict[str, Dict[str, Any]] = {}
+        
         # .envファイルを読み込み
         env_path = project_root / ".env"
         if env_path.exists():
@@ -43,12 +69,15 @@ class ConfigLoader:
         Returns:
             設定辞書
         """
-        with open(self.config_path, 'r', encoding='utf-8') as f:
-            self.config = yaml.safe_load(f)
+        with open(self.config_path, 'rb') as f:
+            self.config = yaml.load(f, Loader=_YamlLoader)
             
         # 環境変数で置換
         self._substitute_env_vars(self.config)
         
+        # get()用にドット区切りキーの索引を構築
+        self._flat = self._flatten(self.config)
+        
         # レイアウトファイルを読み込み
         if 'facility' in self.config and 'layout_file' in self.config['facility']:
             self.load_layout(self.config['facility']['layout_file'])
@@ -65,48 +94,70 @@ class ConfigLoader:
         Returns:
             レイアウト設定
         """
-        with open(layout_path, 'r', encoding='utf-8') as f:
-            self.layout = yaml.safe_load(f)
+        with open(layout_path, 'rb') as f:
+            self.layout = yaml.load(f, Loader=_YamlLoader)
+            
+        # IDによる検索用の索引を構築
+        self._zones_by_id = {
+            zone['id']: zone for zone in self.layout.get('zones', []) if 'id' in zone
+        }
+        self._receivers_by_id = {
+            receiver['id']: receiver
+            for receiver in self.layout.get('receivers', []) if 'id' in receiver
+        }
             
         return self.layout
         
+    @staticmethod
+    def _flatten(config: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        ネストした設定をドット区切りキーの辞書に展開
+        
+        中間の辞書も自身のキーで登録する（get('database')なども引けるように）
+        """
+        flat = {}
+        stack = [('', config)]
+        while stack:
+            prefix, node = stack.pop()
+            for key, value in node.items():
+                path = f"{prefix}{key}"
+                flat[path] = value
+                if isinstance(value, dict):
+                    stack.append((f"{path}.", value))
+        return flat
+        
     def _substitute_env_vars(self, config: Any) -> None:
         """
         環境変数を置換
         
+        文字列中の${VAR}を環境変数の値で置き換える（"${HOST}:${PORT}"のような
+        埋め込みにも対応）。未定義の変数は元の文字列のまま残す
+        
         Args:
             config: 設定オブジェクト
         """
-        if isinstance(config, dict):
-            for key, value in config.items():
-                if isinstance(value, str) and value.startswith('${') and value.endswith('}'):
-                    env_var = value[2:-1]
-                    env_value = os.getenv(env_var, value)
-                    # bool値の変換
-                    if env_value.lower() in ('true', 'false'):
-                        config[key] = env_value.lower() == 'true'
-                    # 数値の変換
-                    elif env_value.isdigit():
-                        config[key] = int(env_value)
-                    else:
-                        config[key] = env_value
+        env = os.environ
+        
+        def replace(match: re.Match) -> str:
+            return env.get(match.group(1), match.group(0))
+        
+        # 再帰せずスタックで走査
+        stack = [config]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                items = node.items()
+            elif isinstance(node, list):
+                items = enumerate(node)
+            else:
+                continue
+            
+            for key, value in items:
+                if isinstance(value, str):
+                    if '${' in value:
+                        node[key] = _coerce(_ENV_RE.sub(replace, value))
                 elif isinstance(value, (dict, list)):
-                    self._substitute_env_vars(value)
-        elif isinstance(config, list):
-            for i, item in enumerate(config):
-                if isinstance(item, str) and item.startswith('${') and item.endswith('}'):
-                    env_var = item[2:-1]
-                    env_value = os.getenv(env_var, item)
-                    # bool値の変換
-                    if env_value.lower() in ('true', 'false'):
-                        config[i] = env_value.lower() == 'true'
-                    # 数値の変換
-                    elif env_value.isdigit():
-                        config[i] = int(env_value)
-                    else:
-                        config[i] = env_value
-                elif isinstance(item, (dict, list)):
-                    self._substitute_env_vars(item)
+                    stack.append(value)
                     
     def get(self, key: str, default: Any = None) -> Any:
         """
@@ -119,16 +170,7 @@ class ConfigLoader:
         Returns:
             設定値
         """
-        keys = key.split('.')
-        value = self.config
-        
-        for k in keys:
-            if isinstance(value, dict) and k in value:
-                value = value[k]
-            else:
-                return default
-                
-        return value
+        return self._flat.get(key, default)
         
     def get_zone_by_id(self, zone_id: str) -> Dict[str, Any]:
         """
@@ -140,14 +182,7 @@ class ConfigLoader:
         Returns:
             ゾーン情報
         """
-        if not self.layout:
-            return None
-            
-        for zone in self.layout.get('zones', []):
-            if zone['id'] == zone_id:
-                return zone
-                
-        return None
+        return self._zones_by_id.get(zone_id)
         
     def get_receiver_by_id(self, receiver_id: str) -> Dict[str, Any]:
         """
@@ -159,14 +194,7 @@ class ConfigLoader:
         Returns:
             受信機情報
         """
-        if not self.layout:
-            return None
-            
-        for receiver in self.layout.get('receivers', []):
-            if receiver['id'] == receiver_id:
-                return receiver
-                
-        return None
+        return self._receivers_by_id.get(receiver_id)
 
 
 def load_config(config_path: str = None) -> Dict[str, Any]:
@@ -1,10 +1,16 @@
 """データ統合モジュール - スキャナーとデータベースを接続"""
 import logging
 import asyncio
+import time
+import uuid
+from array import array
 from typing import Optional, Dict, List, Tuple
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from contextlib import asynccontextmanager
 
+from sqlalchemy import insert, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
 from src.database.connection import DatabaseConnection
 from src.database.repositories import (
     DeviceRepository,
@@ -15,13 +21,41 @@ from src.database.repositories import (
     DetectionRepository,
     AnalyticsRepository
 )
-from src.database.models import Device, TrajectoryPoint, Detection
+from src.database.models import Device, Trajectory, TrajectoryPoint, Detection, DwellTime
 from src.core.config_loader import load_config
 
+# 統計カウンタのインデックス
+_DEVICES_SAVED, _POSITIONS_SAVED, _DETECTIONS_SAVED, _DB_ERRORS, _DROPPED = range(5)
+_STAT_COUNT = 5
+
+# デバイス・日付ごとの軌跡IDを決定的に生成するための名前空間（再起動後も同じIDになる）
+_TRAJECTORY_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'bluetooth-heatmap-system/trajectories')
+
 
 class DataIntegration:
     """スキャンデータとデータベースを統合するクラス"""
     
+    # この件数以上のバッファはCOPYで一括投入する（未満はINSERTのexecutemany）
+    COPY_THRESHOLD = 100
+    
+    # 複数行UPSERT 1文あたりの最大行数（PostgreSQLのバインドパラメータ上限32767に収める）
+    UPSERT_CHUNK_SIZE = 1000
+    
+    # デバイスID → devices主キーのキャッシュ件数の上限
+    DEVICE_ROW_CACHE_SIZE = 10_000
+    
+    # 保存データに付与する現在時刻の更新間隔（秒）
+    CLOCK_RESOLUTION = 0.01
+    
+    # DBエラーログの最小出力間隔（秒）
+    ERROR_LOG_INTERVAL = 5.0
+    
+    # バッファからテーブルへ投入する列（モデルの列名に合わせる）
+    _DETECTION_COLUMNS = ('device_id', 'receiver_id', 'timestamp', 'rssi', 'estimated_distance')
+    _TRAJECTORY_COLUMNS = (
+        'trajectory_id', 'timestamp', 'x_coordinate', 'y_coordinate', 'zone_id', 'confidence'
+    )
+    
     def __init__(self, config: Optional[Dict] = None):
         """
         初期化
@@ -40,25 +74,41 @@ class DataIntegration:
         # データベース接続
         self.db_connection = None
         self.is_connected = False
+        self._supports_copy = False
+        
+        # 保存処理ごとに時刻を取得せず、定期的に更新した時刻を共有する
+        self._now = datetime.utcnow()
+        self._clock_task: Optional[asyncio.Task] = None
         
         # バッチ処理設定
         self.batch_size = config.get('batch_size', 100)
         self.flush_interval = config.get('flush_interval', 5.0)
+        # フラッシュが追いつかない場合のバッファ上限（超えた分は破棄する）
+        self.max_buffer_size = config.get('max_buffer_size', 50_000)
         
         # バッファ
-        self.device_buffer = []
-        self.position_buffer = []
+        self.device_buffer: Dict[str, Dict] = {}
         self.detection_buffer = []
         self.trajectory_buffer = []
         self.dwell_buffer = []
         
-        # 統計
-        self.stats = {
-            'devices_saved': 0,
-            'positions_saved': 0,
-            'detections_saved': 0,
-            'db_errors': 0
+        # デバイスID → devicesテーブルの主キー（軌跡行のdevice_idに使う）
+        self._device_row_ids: Dict[str, str] = {}
+        
+        # バッファごとのフラッシュは同時に1つだけ実行する
+        self._flush_locks = {
+            'devices': asyncio.Lock(),
+            'detections': asyncio.Lock(),
+            'trajectories': asyncio.Lock()
         }
+        self._flush_tasks: Dict[str, asyncio.Task] = {}
+        
+        # 統計（get_statisticsで辞書に変換する）
+        self._stats = array('Q', [0] * _STAT_COUNT)
+        self._last_error_log = 0.0
+        self._suppressed_errors = 0
+        self._last_drop_log = 0.0
+        self._suppressed_drops = 0
         
     async def connect(self, reset_on_start: bool = True) -> bool:
         """データベースに接続
@@ -70,6 +120,9 @@ class DataIntegration:
             self.db_connection = DatabaseConnection(self.config)
             await self.db_connection.connect()
             self.is_connected = True
+            # COPYはasyncpgドライバでのみ利用可能
+            self._supports_copy = self.db_connection.engine.dialect.driver == 'asyncpg'
+            self._start_clock()
             self.logger.info("Database connected successfully")
             
             # 起動時にデータベースをリセット
@@ -90,10 +143,6 @@ class DataIntegration:
             
         try:
             async with self.get_session() as session:
-                # デバイステーブルをクリア
-                device_repo = DeviceRepository(session)
-                await device_repo.delete_all()
-                
                 # 軌跡データをクリア
                 trajectory_repo = TrajectoryRepository(session)
                 await trajectory_repo.delete_all()
@@ -110,6 +159,11 @@ class DataIntegration:
                 flow_repo = FlowRepository(session)
                 await flow_repo.delete_all()
                 
+                # デバイステーブルをクリア（参照している軌跡などを消した後に行う）
+                device_repo = DeviceRepository(session)
+                await device_repo.delete_all()
+                
+                self._device_row_ids.clear()
                 self.logger.info("Database reset completed - all Bluetooth device data cleared")
                 return True
                 
@@ -120,12 +174,81 @@ class DataIntegration:
     async def disconnect(self):
         """データベース接続を切断"""
         if self.db_connection:
-            # バッファをフラッシュ
+            # 実行中のフラッシュを待ってから残りのバッファをフラッシュ
+            await asyncio.gather(*self._flush_tasks.values(), return_exceptions=True)
             await self.flush_all_buffers()
             await self.db_connection.disconnect()
             self.is_connected = False
+            self._stop_clock()
             self.logger.info("Database disconnected")
             
+    def _record_db_error(self, message: str):
+        """
+        DBエラーを記録（障害時にログが溢れないよう出力は一定間隔に間引く）
+        
+        Args:
+            message: エラーメッセージ
+        """
+        self._stats[_DB_ERRORS] += 1
+        
+        now = time.monotonic()
+        if now - self._last_error_log < self.ERROR_LOG_INTERVAL:
+            self._suppressed_errors += 1
+            return
+            
+        if self._suppressed_errors:
+            message = f"{message} ({self._suppressed_errors} similar errors suppressed)"
+        self.logger.error(message)
+        self._last_error_log = now
+        self._suppressed_errors = 0
+        
+    def _buffer_full(self, name: str, size: int) -> bool:
+        """
+        バッファが上限に達しているか判定（達していれば破棄件数を記録する）
+        
+        Args:
+            name: バッファ名
+            size: 現在のバッファ件数
+            
+        Returns:
+            上限に達しているかどうか
+        """
+        if size < self.max_buffer_size:
+            return False
+            
+        self._stats[_DROPPED] += 1
+        
+        now = time.monotonic()
+        if now - self._last_drop_log < self.ERROR_LOG_INTERVAL:
+            self._suppressed_drops += 1
+            return True
+            
+        self.logger.warning(
+            f"{name} buffer full ({size} entries), dropping data "
+            f"({self._suppressed_drops} more dropped since last warning)"
+        )
+        self._last_drop_log = now
+        self._suppressed_drops = 0
+        return True
+        
+    def _start_clock(self):
+        """現在時刻の定期更新を開始"""
+        self._now = datetime.utcnow()
+        if self._clock_task is None:
+            self._clock_task = asyncio.create_task(self._run_clock())
+            
+    def _stop_clock(self):
+        """現在時刻の定期更新を停止"""
+        if self._clock_task is not None:
+            self._clock_task.cancel()
+            self._clock_task = None
+            
+    async def _run_clock(self):
+        """CLOCK_RESOLUTIONごとに現在時刻を更新"""
+        while True:
+            await asyncio.sleep(self.CLOCK_RESOLUTION)
+            self._now = datetime.utcnow()
+            
     @asynccontextmanager
     async def get_session(self):
         """データベースセッションを取得"""
@@ -149,8 +272,17 @@ class DataIntegration:
             
         try:
             async with self.get_session() as session:
+                # 軌跡は履歴として残し、デバイスとの紐付けだけ外す（再登録時に軌跡の保存で付け直す）
+                await session.execute(
+                    update(Trajectory)
+                    .where(Trajectory.device_id.in_(
+                        select(Device.id).where(Device.device_id == device_id)
+                    ))
+                    .values(device_id=None)
+                )
                 device_repo = DeviceRepository(session)
                 await device_repo.delete(device_id)
+                self._device_row_ids.pop(device_id, None)
                 self.logger.info(f"Device {device_id} removed from database")
                 return True
         except Exception as e:
@@ -166,6 +298,9 @@ class DataIntegration:
         """
         デバイス情報を保存
         
+        バッファに追加してすぐに戻り、flush_devicesでまとめてUPSERTする。
+        同じデバイスの検出はバッファ内で1行にまとめる
+        
         Args:
             device_id: デバイスID（ハッシュ化済み）
             mac_address: MACアドレス（ハッシュ化済み）
@@ -173,7 +308,7 @@ class DataIntegration:
             position: 現在位置
             zone_id: 現在のゾーン
             rssi: 信号強度
-            check_duplicate: 重複チェックを行うか
+            check_duplicate: 互換性のため残している（UPSERTで常に重複を統合する）
             
         Returns:
             保存成功したかどうか
@@ -181,80 +316,43 @@ class DataIntegration:
         if not self.is_connected:
             return False
             
-        try:
-            async with self.get_session() as session:
-                device_repo = DeviceRepository(session)
-                
-                # 重複チェック
-                if check_duplicate:
-                    # 既存デバイスを確認
-                    existing = await device_repo.get_by_id(device_id)
-                else:
-                    existing = None
-                
-                if existing:
-                    # 既存デバイスを更新
-                    update_data = {
-                        'last_seen': datetime.utcnow(),
-                        'total_detections': existing.total_detections + 1
-                    }
-                    
-                    if position:
-                        update_data['current_x'] = position[0]
-                        update_data['current_y'] = position[1]
-                    if zone_id:
-                        update_data['current_zone'] = zone_id
-                    if rssi:
-                        update_data['signal_strength'] = rssi
-                        
-                    await device_repo.update(device_id, update_data)
-                    self.logger.info(f"[UPDATED] デバイス {device_id[:8]}... を更新 (検出回数: {existing.total_detections + 1})")
-                else:
-                    # 新規デバイスを作成
-                    device_data = {
-                        'device_id': device_id,
-                        'mac_address': mac_address,
-                        'device_name': device_name,
-                        'device_type': 'unknown',
-                        'first_seen': datetime.utcnow(),
-                        'last_seen': datetime.utcnow(),
-                        'current_x': position[0] if position else None,
-                        'current_y': position[1] if position else None,
-                        'current_zone': zone_id,
-                        'signal_strength': rssi,
-                        'total_detections': 1
-                    }
-                    created = await device_repo.create(device_data)
-                    if created:
-                        self.logger.info(f"[SAVED] デバイス {device_id[:8]}... をデータベースに保存")
-                    else:
-                        # UNIQUE制約違反の場合、既存デバイスを更新
-                        existing = await device_repo.get_by_id(device_id)
-                        if existing:
-                            update_data = {
-                                'last_seen': datetime.utcnow(),
-                                'total_detections': existing.total_detections + 1
-                            }
-                            if position:
-                                update_data['current_x'] = position[0]
-                                update_data['current_y'] = position[1]
-                            if zone_id:
-                                update_data['current_zone'] = zone_id
-                            if rssi:
-                                update_data['signal_strength'] = rssi
-                            await device_repo.update(device_id, update_data)
-                            self.logger.info(f"[UPDATED] デバイス {device_id[:8]}... を更新 (競合状態から回復)")
+        now = self._now
+        row = self.device_buffer.get(device_id)
+        if row is None:
+            # 既存行への統合はバッファを増やさないため、新しいデバイスのみ制限する
+            if self._buffer_full('devices', len(self.device_buffer)):
+                return False
+            self.device_buffer[device_id] = {
+                'id': str(uuid.uuid4()),
+                'device_id': device_id,
+                'mac_address': mac_address,
+                'device_name': device_name,
+                'device_type': 'unknown',
+                'first_seen': now,
+                'last_seen': now,
+                'current_x': position[0] if position else None,
+                'current_y': position[1] if position else None,
+                'current_zone': zone_id,
+                'signal_strength': int(round(rssi)) if rssi else None,
+                'total_detections': 1
+            }
+        else:
+            row['last_seen'] = now
+            row['total_detections'] += 1
+            if position:
+                row['current_x'] = position[0]
+                row['current_y'] = position[1]
+            if zone_id:
+                row['current_zone'] = zone_id
+            if rssi:
+                row['signal_strength'] = int(round(rssi))
                 
-                self.stats['devices_saved'] += 1
-                return True
-                
-        except Exception as e:
-            self.logger.error(f"Error saving device {device_id}: {e}")
-            import traceback
-            self.logger.error(f"Traceback: {traceback.format_exc()}")
-            self.stats['db_errors'] += 1
-            return False
+        # バッファサイズを超えたらフラッシュ
+        if len(self.device_buffer) >= self.batch_size:
+            self._schedule_flush('devices', self.flush_devices)
             
+        return True
+        
     async def save_position(self, device_id: str, position: Tuple[float, float],
                            zone_id: Optional[str] = None, confidence: float = 1.0,
                            timestamp: Optional[datetime] = None) -> bool:
@@ -271,25 +369,10 @@ class DataIntegration:
         Returns:
             保存成功したかどうか
         """
-        if not self.is_connected:
-            return False
-            
-        position_data = {
-            'device_id': device_id,
-            'x': position[0],
-            'y': position[1],
-            'zone_id': zone_id,
-            'confidence': confidence,
-            'timestamp': timestamp or datetime.utcnow()
-        }
-        
-        self.position_buffer.append(position_data)
-        
-        # バッファサイズを超えたらフラッシュ
-        if len(self.position_buffer) >= self.batch_size:
-            await self.flush_positions()
-            
-        return True
+        # 位置は軌跡バッファにまとめ、フラッシュ時にデバイス・日付ごとの軌跡に割り当てる
+        return await self.save_trajectory_point(
+            None, device_id, position, zone_id, timestamp, confidence=confidence
+        )
         
     async def save_detection(self, device_id: str, receiver_id: str,
                              rssi: float, distance: float,
@@ -309,42 +392,48 @@ class DataIntegration:
         """
         if not self.is_connected:
             return False
+        if self._buffer_full('detections', len(self.detection_buffer)):
+            return False
             
         detection_data = {
             'device_id': device_id,
             'receiver_id': receiver_id,
             'rssi': rssi,
             'distance': distance,
-            'timestamp': timestamp or datetime.utcnow()
+            'timestamp': timestamp or self._now
         }
         
         self.detection_buffer.append(detection_data)
         
         # バッファサイズを超えたらフラッシュ
         if len(self.detection_buffer) >= self.batch_size:
-            await self.flush_detections()
+            self._schedule_flush('detections', self.flush_detections)
             
         return True
         
-    async def save_trajectory_point(self, trajectory_id: str, device_id: str,
+    async def save_trajectory_point(self, trajectory_id: Optional[str], device_id: str,
                                    position: Tuple[float, float],
                                    zone_id: Optional[str] = None,
-                                   timestamp: Optional[datetime] = None) -> bool:
+                                   timestamp: Optional[datetime] = None,
+                                   confidence: float = 1.0) -> bool:
         """
         軌跡ポイントを保存
         
         Args:
-            trajectory_id: 軌跡ID
+            trajectory_id: 軌跡ID（Noneの場合はデバイス・日付ごとの軌跡に割り当てる）
             device_id: デバイスID
             position: 位置座標
             zone_id: ゾーンID
             timestamp: タイムスタンプ
+            confidence: 信頼度
             
         Returns:
             保存成功したかどうか
         """
         if not self.is_connected:
             return False
+        if self._buffer_full('trajectories', len(self.trajectory_buffer)):
+            return False
             
         point_data = {
             'trajectory_id': trajectory_id,
@@ -352,14 +441,15 @@ class DataIntegration:
             'x': position[0],
             'y': position[1],
             'zone_id': zone_id,
-            'timestamp': timestamp or datetime.utcnow()
+            'confidence': confidence,
+            'timestamp': timestamp or self._now
         }
         
         self.trajectory_buffer.append(point_data)
         
         # バッファサイズを超えたらフラッシュ
         if len(self.trajectory_buffer) >= self.batch_size:
-            await self.flush_trajectories()
+            self._schedule_flush('trajectories', self.flush_trajectories)
             
         return True
         
@@ -384,8 +474,6 @@ class DataIntegration:
             
         try:
             async with self.get_session() as session:
-                dwell_repo = DwellTimeRepository(session)
-                
                 dwell_data = {
                     'device_id': device_id,
                     'zone_id': zone_id,
@@ -395,12 +483,12 @@ class DataIntegration:
                     'is_active': exit_time is None
                 }
                 
-                await dwell_repo.create(dwell_data)
+                # ORMオブジェクトを生成せずCore INSERTで挿入
+                await session.execute(insert(DwellTime.__table__).values(dwell_data))
                 return True
                 
         except Exception as e:
-            self.logger.error(f"Error saving dwell time: {e}")
-            self.stats['db_errors'] += 1
+            self._record_db_error(f"Error saving dwell time: {e}")
             return False
             
     async def save_flow_transition(self, device_id: str, from_zone: str,
@@ -427,89 +515,284 @@ class DataIntegration:
                 flow_repo = FlowRepository(session)
                 
                 # フロー統計を更新
-                await flow_repo.increment_flow(from_zone, to_zone, timestamp.date())
+                await flow_repo.update_flow_matrix(from_zone, to_zone, timestamp)
                 return True
                 
         except Exception as e:
-            self.logger.error(f"Error saving flow transition: {e}")
-            self.stats['db_errors'] += 1
+            self._record_db_error(f"Error saving flow transition: {e}")
             return False
             
-    async def flush_positions(self):
-        """位置バッファをフラッシュ"""
-        if not self.position_buffer or not self.is_connected:
+    async def _bulk_insert(self, session, table, columns: Tuple[str, ...],
+                           records: List[Tuple]):
+        """
+        レコードをテーブルへ一括挿入
+        
+        Args:
+            session: データベースセッション
+            table: 挿入先テーブル
+            columns: 列名
+            records: 列順に並べたレコード
+        """
+        if self._supports_copy and len(records) >= self.COPY_THRESHOLD:
+            # COPYプロトコルで1回の往復で投入（セッションのトランザクション内で実行）
+            connection = await session.connection()
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.driver_connection.copy_records_to_table(
+                table.name, records=records, columns=columns
+            )
+        else:
+            await session.execute(
+                insert(table), [dict(zip(columns, record)) for record in records]
+            )
+            
+    @staticmethod
+    def _device_upsert(rows: List[Dict]):
+        """
+        デバイス行のUPSERT文を構築
+        
+        Args:
+            rows: デバイス行
+            
+        Returns:
+            INSERT ... ON CONFLICT文
+        """
+        devices = Device.__table__
+        stmt = pg_insert(devices).values(rows)
+        excluded = stmt.excluded
+        return stmt.on_conflict_do_update(
+            index_elements=[devices.c.device_id],
+            set_={
+                'last_seen': excluded.last_seen,
+                'total_detections': devices.c.total_detections + excluded.total_detections,
+                'current_x': func.coalesce(excluded.current_x, devices.c.current_x),
+                'current_y': func.coalesce(excluded.current_y, devices.c.current_y),
+                'current_zone': func.coalesce(excluded.current_zone, devices.c.current_zone),
+                'signal_strength': func.coalesce(excluded.signal_strength, devices.c.signal_strength)
+            }
+        )
+        
+    async def flush_devices(self):
+        """デバイスバッファをフラッシュ（INSERT ... ON CONFLICTで一括UPSERT）"""
+        if not self.device_buffer or not self.is_connected:
             return
             
-        try:
-            async with self.get_session() as session:
-                trajectory_repo = TrajectoryRepository(session)
-                
-                # バッチ挿入
-                for pos_data in self.position_buffer:
-                    # 軌跡ポイントとして保存
-                    point = TrajectoryPoint(
-                        device_id=pos_data['device_id'],
-                        x=pos_data['x'],
-                        y=pos_data['y'],
-                        zone_id=pos_data['zone_id'],
-                        timestamp=pos_data['timestamp']
-                    )
-                    session.add(point)
+        async with self._flush_locks['devices']:
+            buffer, self.device_buffer = self.device_buffer, {}
+            if not buffer:
+                return
                 
-                await session.commit()
-                self.stats['positions_saved'] += len(self.position_buffer)
-                self.position_buffer.clear()
+            try:
+                async with self.get_session() as session:
+                    # 1文のパラメータ数が上限を超えないよう分割して送る（同一トランザクション）
+                    rows = list(buffer.values())
+                    for start in range(0, len(rows), self.UPSERT_CHUNK_SIZE):
+                        await session.execute(
+                            self._device_upsert(rows[start:start + self.UPSERT_CHUNK_SIZE])
+                        )
+                    
+                    await session.commit()
+                    self._stats[_DEVICES_SAVED] += len(buffer)
+                    self.logger.debug(f"[SAVED] {len(buffer)} デバイスをデータベースに保存")
+                    
+            except Exception as e:
+                self._record_db_error(f"Error flushing devices: {e}")
+                # 書き込めなかった分は新しいバッファの内容とまとめて再試行
+                for device_id, row in buffer.items():
+                    newer = self.device_buffer.get(device_id)
+                    if newer is not None:
+                        newer['first_seen'] = row['first_seen']
+                        newer['total_detections'] += row['total_detections']
+                    else:
+                        self.device_buffer[device_id] = row
                 
-        except Exception as e:
-            self.logger.error(f"Error flushing positions: {e}")
-            self.stats['db_errors'] += 1
-            
     async def flush_detections(self):
         """検出バッファをフラッシュ"""
         if not self.detection_buffer or not self.is_connected:
             return
             
-        try:
-            async with self.get_session() as session:
-                # バッチ挿入
-                for det_data in self.detection_buffer:
-                    detection = Detection(**det_data)
-                    session.add(detection)
+        async with self._flush_locks['detections']:
+            buffer, self.detection_buffer = self.detection_buffer, []
+            if not buffer:
+                return
                 
-                await session.commit()
-                self.stats['detections_saved'] += len(self.detection_buffer)
-                self.detection_buffer.clear()
+            try:
+                async with self.get_session() as session:
+                    # バッチ挿入（rssiは整数列）
+                    records = [
+                        (d['device_id'], d['receiver_id'], d['timestamp'],
+                         int(round(d['rssi'])), d['distance'])
+                        for d in buffer
+                    ]
+                    await self._bulk_insert(
+                        session, Detection.__table__, self._DETECTION_COLUMNS, records
+                    )
+                    
+                    await session.commit()
+                    self._stats[_DETECTIONS_SAVED] += len(buffer)
+                    
+            except Exception as e:
+                self._record_db_error(f"Error flushing detections: {e}")
+                self.detection_buffer[:0] = buffer
                 
-        except Exception as e:
-            self.logger.error(f"Error flushing detections: {e}")
-            self.stats['db_errors'] += 1
-            
     async def flush_trajectories(self):
         """軌跡バッファをフラッシュ"""
         if not self.trajectory_buffer or not self.is_connected:
             return
             
-        try:
-            async with self.get_session() as session:
-                trajectory_repo = TrajectoryRepository(session)
+        async with self._flush_locks['trajectories']:
+            buffer, self.trajectory_buffer = self.trajectory_buffer, []
+            if not buffer:
+                return
                 
-                # バッチ挿入
-                await trajectory_repo.add_points(
-                    self.trajectory_buffer[0]['trajectory_id'],
-                    self.trajectory_buffer
-                )
+            deferred = []
+            try:
+                async with self.get_session() as session:
+                    # 軌跡IDのない位置をデバイスの軌跡に割り当てる（デバイス未保存の分は後回し）
+                    records, deferred = await self._assign_device_trajectories(session, buffer)
+                    
+                    if records:
+                        # バッチ挿入（ポイントごとに所属する軌跡IDを保持）
+                        await self._bulk_insert(
+                            session, TrajectoryPoint.__table__, self._TRAJECTORY_COLUMNS, records
+                        )
+                        
+                        await session.commit()
+                        self._stats[_POSITIONS_SAVED] += len(records)
+                    
+            except Exception as e:
+                self._record_db_error(f"Error flushing trajectories: {e}")
+                # 割り当てた軌跡IDはバッファ側に書き戻していないため、次回は軌跡行から作り直される
+                deferred = buffer
                 
-                self.trajectory_buffer.clear()
+            if deferred:
+                self.trajectory_buffer[:0] = deferred
                 
-        except Exception as e:
-            self.logger.error(f"Error flushing trajectories: {e}")
-            self.stats['db_errors'] += 1
+    async def _assign_device_trajectories(self, session,
+                                          points: List[Dict]) -> Tuple[List[Tuple], List[Dict]]:
+        """
+        軌跡IDのない位置にデバイス・日付ごとの軌跡を割り当て、軌跡行をUPSERTする
+        
+        割り当てた軌跡IDはレコードにのみ反映し、バッファの位置は変更しない
+        （コミットに失敗して再バッファした位置が、ロールバックされた軌跡を参照しないため）
+        
+        Args:
+            session: データベースセッション
+            points: 軌跡バッファの位置
+            
+        Returns:
+            (trajectory_pointsへ投入するレコード, デバイスの保存待ちで後回しにする位置)
+        """
+        records = []
+        groups: Dict[Tuple[str, date], List[Dict]] = {}
+        for point in points:
+            if point['trajectory_id'] is None:
+                groups.setdefault((point['device_id'], point['timestamp'].date()), []).append(point)
+            else:
+                records.append(self._trajectory_record(point['trajectory_id'], point))
+        if not groups:
+            return records, []
+            
+        # 軌跡行のdevice_idはdevicesテーブルの主キーを参照するため、未取得分をまとめて引く
+        unknown = {device_id for device_id, _ in groups} - self._device_row_ids.keys()
+        if unknown:
+            result = await session.execute(
+                select(Device.device_id, Device.id).where(Device.device_id.in_(unknown))
+            )
+            self._device_row_ids.update(result.tuples().all())
+            # 上限を超えた分は古いものから捨てる（必要になれば再度引く）
+            while len(self._device_row_ids) > self.DEVICE_ROW_CACHE_SIZE:
+                del self._device_row_ids[next(iter(self._device_row_ids))]
+            
+        trajectory_rows = []
+        deferred = []
+        for (device_id, day), group in groups.items():
+            row_id = self._device_row_ids.get(device_id)
+            if row_id is None:
+                # デバイスが保存待ちなら次回に回し、それ以外は紐付け先がないため破棄する
+                if device_id in self.device_buffer or self._flush_locks['devices'].locked():
+                    deferred.extend(group)
+                else:
+                    self._stats[_DROPPED] += len(group)
+                continue
+                
+            trajectory_id = str(uuid.uuid5(_TRAJECTORY_NAMESPACE, f"{device_id}:{day.isoformat()}"))
+            timestamps = []
+            for point in group:
+                records.append(self._trajectory_record(trajectory_id, point))
+                timestamps.append(point['timestamp'])
+            trajectory_rows.append({
+                'id': trajectory_id,
+                'device_id': row_id,
+                'start_time': min(timestamps),
+                'end_time': max(timestamps),
+                'point_count': len(group)
+            })
+            
+        for start in range(0, len(trajectory_rows), self.UPSERT_CHUNK_SIZE):
+            await session.execute(
+                self._trajectory_upsert(trajectory_rows[start:start + self.UPSERT_CHUNK_SIZE])
+            )
+            
+        return records, deferred
+        
+    @staticmethod
+    def _trajectory_record(trajectory_id: str, point: Dict) -> Tuple:
+        """位置をtrajectory_pointsの列順（_TRAJECTORY_COLUMNS）のレコードに変換"""
+        return (trajectory_id, point['timestamp'], point['x'], point['y'],
+                point['zone_id'], point['confidence'])
+        
+    @staticmethod
+    def _trajectory_upsert(rows: List[Dict]):
+        """
+        軌跡行のUPSERT文を構築（既存の軌跡はデバイスの紐付け・期間・点数を更新）
+        
+        Args:
+            rows: 軌跡行
             
+        Returns:
+            INSERT ... ON CONFLICT文
+        """
+        trajectories = Trajectory.__table__
+        stmt = pg_insert(trajectories).values(rows)
+        excluded = stmt.excluded
+        return stmt.on_conflict_do_update(
+            index_elements=[trajectories.c.id],
+            set_={
+                'device_id': excluded.device_id,
+                'start_time': func.least(trajectories.c.start_time, excluded.start_time),
+                'end_time': func.greatest(trajectories.c.end_time, excluded.end_time),
+                'point_count': func.coalesce(trajectories.c.point_count, 0) + excluded.point_count
+            }
+        )
+                
+    def _schedule_flush(self, name: str, flush):
+        """
+        フラッシュをバックグラウンドで開始（呼び出し元は書き込み完了を待たない）
+        
+        Args:
+            name: バッファ名
+            flush: フラッシュ用のコルーチン関数
+        """
+        # 同じバッファのフラッシュが開始待ち・実行中であれば重ねて起動しない
+        if name in self._flush_tasks:
+            return
+        task = asyncio.create_task(flush())
+        self._flush_tasks[name] = task
+        task.add_done_callback(lambda _: self._flush_tasks.pop(name, None))
+        
     async def flush_all_buffers(self):
         """すべてのバッファをフラッシュ"""
-        await self.flush_positions()
-        await self.flush_detections()
-        await self.flush_trajectories()
+        # 各フラッシュは別テーブルへの独立した書き込みで、それぞれ専用の
+        # セッション（プール接続）を使うため並行して実行する
+        results = await asyncio.gather(
+            self.flush_devices(),
+            self.flush_detections(),
+            self.flush_trajectories(),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                self._record_db_error(f"Error flushing buffers: {result!r}")
         
     async def periodic_flush(self):
         """定期的にバッファをフラッシュ"""
@@ -520,12 +803,13 @@ class DataIntegration:
     def get_statistics(self) -> Dict:
         """統計情報を取得"""
         return {
-            'devices_saved': self.stats['devices_saved'],
-            'positions_saved': self.stats['positions_saved'],
-            'detections_saved': self.stats['detections_saved'],
-            'db_errors': self.stats['db_errors'],
+            'devices_saved': self._stats[_DEVICES_SAVED],
+            'positions_saved': self._stats[_POSITIONS_SAVED],
+            'detections_saved': self._stats[_DETECTIONS_SAVED],
+            'db_errors': self._stats[_DB_ERRORS],
+            'dropped': self._stats[_DROPPED],
             'buffer_sizes': {
-                'positions': len(self.position_buffer),
+                'devices': len(self.device_buffer),
                 'detections': len(self.detection_buffer),
                 'trajectories': len(self.trajectory_buffer)
             },
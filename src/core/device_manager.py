@@ -1,15 +1,110 @@
 """デバイス管理モジュール"""
 import hashlib
 import logging
+import re
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Set, Tuple
 from dataclasses import dataclass, field
-from collections import defaultdict
+from collections import Counter, defaultdict, OrderedDict
+from functools import lru_cache
 
 import numpy as np
 
 
-@dataclass
+@lru_cache(maxsize=4096)
+def _hash_mac_address(mac_address: str) -> str:
+    """MACアドレスのハッシュ値（同じMACアドレスの再計算を省略するためキャッシュ）"""
+    return hashlib.sha256(mac_address.encode()).hexdigest()[:16]
+
+
+class PositionHistory:
+    """
+    位置履歴のリングバッファ
+    
+    座標と時刻を事前確保した配列に列ごとに保持し、追加時の確保・コピーをなくす。
+    要素は従来どおり (datetime, (x, y)) のタプルとして取り出せる
+    """
+    
+    __slots__ = ('capacity', '_x', '_y', '_ts', '_head', '_count')
+    
+    def __init__(self, capacity: int = 100):
+        """
+        初期化
+        
+        Args:
+            capacity: 保持する最大件数
+        """
+        self.capacity = capacity
+        self._x = np.empty(capacity, dtype=np.float64)
+        self._y = np.empty(capacity, dtype=np.float64)
+        self._ts = np.empty(capacity, dtype='datetime64[us]')
+        self._head = 0  # 次に書き込む位置
+        self._count = 0
+        
+    def append(self, entry: Tuple[datetime, Tuple[float, float]]):
+        """
+        位置を追加（上限を超えた場合は最も古い位置を上書き）
+        
+        Args:
+            entry: (時刻, (x, y))
+        """
+        timestamp, (x, y) = entry
+        head = self._head
+        self._x[head] = x
+        self._y[head] = y
+        self._ts[head] = timestamp
+        self._head = (head + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+            
+    def __len__(self) -> int:
+        return self._count
+        
+    def __getitem__(self, index: int) -> Tuple[datetime, Tuple[float, float]]:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("position history index out of range")
+        i = (self._head - self._count + index) % self.capacity
+        return self._ts[i].item(), (float(self._x[i]), float(self._y[i]))
+        
+    def __iter__(self):
+        return iter(self.between())
+        
+    def _order(self) -> np.ndarray:
+        """古い順に並べたバッファ上のインデックス"""
+        return (np.arange(self._count) + (self._head - self._count)) % self.capacity
+        
+    def between(self, start_time: Optional[datetime] = None,
+                end_time: Optional[datetime] = None) -> List[Tuple[datetime, Tuple[float, float]]]:
+        """
+        時間範囲内の位置を古い順に取得
+        
+        Args:
+            start_time: 開始時刻
+            end_time: 終了時刻
+            
+        Returns:
+            (時刻, (x, y)) のリスト
+        """
+        order = self._order()
+        timestamps = self._ts[order]
+        
+        # 時間範囲をまとめてマスクで絞り込む
+        mask = np.ones(len(order), dtype=bool)
+        if start_time:
+            mask &= timestamps >= np.datetime64(start_time)
+        if end_time:
+            mask &= timestamps <= np.datetime64(end_time)
+        order = order[mask]
+        
+        return list(zip(
+            self._ts[order].astype(object).tolist(),
+            zip(self._x[order].tolist(), self._y[order].tolist())
+        ))
+
+
+@dataclass(slots=True)
 class Device:
     """管理対象デバイス"""
     device_id: str  # 匿名化されたID
@@ -23,7 +118,7 @@ class Device:
     zones_visited: Set[str] = field(default_factory=set)
     current_zone: Optional[str] = None
     current_position: Optional[Tuple[float, float]] = None
-    position_history: List[Tuple[datetime, Tuple[float, float]]] = field(default_factory=list)
+    position_history: PositionHistory = field(default_factory=PositionHistory)
     metadata: Dict = field(default_factory=dict)
 
 
@@ -43,8 +138,13 @@ class DeviceManager:
         # デバイス管理
         self.devices: Dict[str, Device] = {}  # device_id -> Device
         self.mac_to_id: Dict[str, str] = {}  # mac_address -> device_id
+        self.id_to_mac: Dict[str, str] = {}  # device_id -> mac_address（削除時の逆引き用）
         self.current_scan_devices: Set[str] = set()  # 現在のスキャンで検出されたデバイスID
         self.previous_scan_devices: Set[str] = set()  # 前回のスキャンで検出されたデバイスID
+        self._total_zones_visited = 0  # 全デバイスの訪問ゾーン数の合計（平均を都度走査せずに求める）
+        # 最終検出時刻の古い順に並べたデバイスID（検出のたびに末尾へ移動）
+        self._by_last_seen: "OrderedDict[str, None]" = OrderedDict()
+        self._by_zone: Dict[str, Set[str]] = defaultdict(set)  # zone_id -> 現在そのゾーンにいるデバイスID
         
         # プライバシー設定
         self.anonymize = config.get('anonymize', True)
@@ -59,6 +159,11 @@ class DeviceManager:
             'laptop': ['MacBook', 'ThinkPad', 'Laptop'],
             'tablet': ['iPad', 'Tab', 'Tablet']
         }
+        # タイプごとのパターンを大文字小文字を区別しない正規表現にまとめておく（判定順は定義順）
+        self._type_regexes = [
+            (device_type, re.compile('|'.join(map(re.escape, patterns)), re.IGNORECASE))
+            for device_type, patterns in self.device_patterns.items()
+        ]
         
         # 統計情報
         self.stats = {
@@ -91,7 +196,7 @@ class DeviceManager:
             
         # MACアドレスのみでハッシュ化（同じデバイスは常に同じID）
         # プライバシーのためMACアドレスを直接保存しない
-        return hashlib.sha256(mac_address.encode()).hexdigest()[:16]
+        return _hash_mac_address(mac_address)
         
     def register_device(self, mac_address: str, 
                        device_name: Optional[str] = None,
@@ -117,7 +222,7 @@ class DeviceManager:
             # スキャン内で再度検出された場合もカウントアップ
             if device_id in self.devices:
                 device = self.devices[device_id]
-                device.last_seen = datetime.now()
+                self._touch(device)
                 device.total_detections += 1
             self.logger.debug(f"Device {device_id} already processed in current scan")
             return None
@@ -131,7 +236,7 @@ class DeviceManager:
                 device = self.devices[device_id]
                 
                 # 最終検出時刻を更新
-                device.last_seen = datetime.now()
+                self._touch(device)
                 device.total_detections += 1
                 
                 # デバイス名が提供されていて、まだ設定されていない場合は更新
@@ -155,7 +260,7 @@ class DeviceManager:
             self.current_scan_devices.add(device_id)
             # 既存デバイスを更新
             device = self.devices[device_id]
-            device.last_seen = datetime.now()
+            self._touch(device)
             device.total_detections += 1
             if device_name and not device.device_name:
                 device.device_name = device_name
@@ -164,12 +269,13 @@ class DeviceManager:
             
         # 新規デバイス作成
         device_type = self._detect_device_type(device_name)
+        now = datetime.now()
         
         device = Device(
             device_id=device_id,
             mac_address=mac_address if not self.anonymize else "",
-            first_seen=datetime.now(),
-            last_seen=datetime.now(),
+            first_seen=now,
+            last_seen=now,
             device_name=device_name,
             device_type=device_type,
             is_anonymous=self.anonymize,
@@ -179,20 +285,80 @@ class DeviceManager:
         # 登録
         self.devices[device_id] = device
         self.mac_to_id[mac_address] = device_id
+        self.id_to_mac[device_id] = mac_address
         self.current_scan_devices.add(device_id)
+        self._by_last_seen[device_id] = None
         
         # 統計更新
         self.stats['total_devices'] += 1
         self.stats['device_types'][device_type] += 1
         
         # 今日の新規デバイスかチェック
-        if device.first_seen.date() == datetime.now().date():
+        if device.first_seen.date() == now.date():
             self.stats['new_devices_today'] += 1
             
         self.logger.info(f"New device registered: {device_id} (type: {device_type})")
         
         return device
         
+    def register_devices(self, batch: List[Tuple[str, Optional[str], int]]) -> List[str]:
+        """
+        1スキャン分のデバイスをまとめて登録（重複チェック付き）
+        
+        既存デバイスは時刻を1回だけ取得してまとめて更新し、
+        新規デバイスなど個別の判定が必要なものはregister_deviceで登録する
+        
+        Args:
+            batch: (MACアドレス, デバイス名, 信号強度) のリスト
+            
+        Returns:
+            各要素に対応するデバイスID
+        """
+        now = datetime.now()
+        device_ids = [self._anonymize_mac(mac_address) for mac_address, _, _ in batch]
+        current_scan_devices = self.current_scan_devices
+        
+        for device_id, (mac_address, device_name, rssi) in zip(device_ids, batch):
+            device = self.devices.get(device_id)
+            if device is None or self.mac_to_id.get(mac_address) != device_id:
+                self.register_device(mac_address, device_name, rssi)
+                continue
+                
+            self._touch(device, now)
+            device.total_detections += 1
+            
+            # スキャン内で初めての検出のみデバイス名を補完する（register_deviceと同じ）
+            if device_id not in current_scan_devices:
+                if device_name and not device.device_name:
+                    device.device_name = device_name
+                    device.device_type = self._detect_device_type(device_name)
+                current_scan_devices.add(device_id)
+                
+        return device_ids
+        
+    def _touch(self, device: Device, now: Optional[datetime] = None):
+        """
+        最終検出時刻を更新し、最終検出順のインデックスで末尾に移動
+        
+        Args:
+            device: 対象デバイス
+            now: 現在時刻（省略時は取得する）
+        """
+        device.last_seen = now or datetime.now()
+        self._by_last_seen.move_to_end(device.device_id)
+        
+    def _forget(self, device: Device):
+        """
+        削除するデバイスをインデックスから除外
+        
+        Args:
+            device: 対象デバイス
+        """
+        self._by_last_seen.pop(device.device_id, None)
+        if device.current_zone:
+            self._by_zone[device.current_zone].discard(device.device_id)
+        self._total_zones_visited -= len(device.zones_visited)
+        
     def _detect_device_type(self, device_name: Optional[str]) -> str:
         """
         デバイスタイプを検出
@@ -206,21 +372,16 @@ class DeviceManager:
         if not device_name:
             return "unknown"
             
-        device_name_lower = device_name.lower()
-        
-        for device_type, patterns in self.device_patterns.items():
-            for pattern in patterns:
-                if pattern.lower() in device_name_lower:
-                    return device_type
+        for device_type, regex in self._type_regexes:
+            if regex.search(device_name):
+                return device_type
                     
         return "unknown"
     
     def start_new_scan(self):
         """新しいスキャンサイクルを開始"""
-        # 前回のスキャンデバイスを保存
-        self.previous_scan_devices = self.current_scan_devices.copy()
-        # 現在のスキャンデバイスをクリア
-        self.current_scan_devices.clear()
+        # 現在のスキャンデバイスを前回分として引き継ぎ、新しい集合で開始（コピーしない）
+        self.previous_scan_devices, self.current_scan_devices = self.current_scan_devices, set()
         self.logger.debug(f"New scan cycle started. Previous devices: {len(self.previous_scan_devices)}")
     
     def cleanup_undetected_devices(self) -> List[str]:
@@ -233,22 +394,20 @@ class DeviceManager:
         undetected_devices = self.previous_scan_devices - self.current_scan_devices
         removed_devices = []
         
+        # 5秒以上検出されない場合に削除（よりリアルタイムな表示のため）
+        threshold = datetime.now() - timedelta(seconds=5)
+        
         for device_id in undetected_devices:
             if device_id in self.devices:
                 device = self.devices[device_id]
                 # 最後の検出から一定時間経過していたら削除
-                time_since_last_seen = (datetime.now() - device.last_seen).total_seconds()
-                
-                # 即座に削除（よりリアルタイムな表示のため）
-                if time_since_last_seen > 5:  # 5秒以上検出されない場合（リアルタイム性向上）
+                if device.last_seen < threshold:
                     # MACアドレスマッピングを削除
-                    for mac, did in list(self.mac_to_id.items()):
-                        if did == device_id:
-                            del self.mac_to_id[mac]
-                            break
+                    self.mac_to_id.pop(self.id_to_mac.pop(device_id, None), None)
                     
                     # デバイスを削除
                     del self.devices[device_id]
+                    self._forget(device)
                     removed_devices.append(device_id)
                     
                     # 統計更新
@@ -289,18 +448,20 @@ class DeviceManager:
             
         device = self.devices[device_id]
         
-        # 位置更新
+        # 位置更新（履歴は直近100件のリングバッファ）
         device.current_position = position
         device.position_history.append((datetime.now(), position))
-        
-        # 履歴サイズ制限（直近100件）
-        if len(device.position_history) > 100:
-            device.position_history = device.position_history[-100:]
             
         # ゾーン更新
         if zone_id:
+            if device.current_zone != zone_id:
+                if device.current_zone:
+                    self._by_zone[device.current_zone].discard(device_id)
+                self._by_zone[zone_id].add(device_id)
             device.current_zone = zone_id
-            device.zones_visited.add(zone_id)
+            if zone_id not in device.zones_visited:
+                device.zones_visited.add(zone_id)
+                self._total_zones_visited += 1
             
     def get_device(self, device_id: str) -> Optional[Device]:
         """デバイス情報を取得"""
@@ -326,10 +487,14 @@ class DeviceManager:
         current_time = datetime.now()
         timeout_threshold = current_time - timedelta(minutes=timeout_minutes)
         
-        active_devices = [
-            device for device in self.devices.values()
-            if device.last_seen >= timeout_threshold
-        ]
+        # 最終検出の新しい順にたどり、閾値より古いデバイスに達したら打ち切る
+        active_devices = []
+        for device_id in reversed(self._by_last_seen):
+            device = self.devices[device_id]
+            if device.last_seen < timeout_threshold:
+                break
+            active_devices.append(device)
+        active_devices.reverse()
         
         self.stats['active_devices'] = len(active_devices)
         
@@ -345,9 +510,11 @@ class DeviceManager:
         Returns:
             ゾーン内のデバイスリスト
         """
+        timeout_threshold = datetime.now() - timedelta(minutes=5)
+        
         return [
-            device for device in self.get_active_devices()
-            if device.current_zone == zone_id
+            device for device in map(self.devices.__getitem__, self._by_zone.get(zone_id, ()))
+            if device.last_seen >= timeout_threshold
         ]
         
     def get_device_trajectory(self, device_id: str,
@@ -368,15 +535,8 @@ class DeviceManager:
         if not device:
             return []
             
-        trajectory = device.position_history
-        
         # 時間範囲でフィルタ
-        if start_time:
-            trajectory = [(t, p) for t, p in trajectory if t >= start_time]
-        if end_time:
-            trajectory = [(t, p) for t, p in trajectory if t <= end_time]
-            
-        return trajectory
+        return device.position_history.between(start_time, end_time)
         
     def cleanup_old_devices(self, days: int = 30) -> int:
         """
@@ -391,18 +551,20 @@ class DeviceManager:
         current_time = datetime.now()
         threshold = current_time - timedelta(days=days)
         
+        # 最終検出の古い順にたどり、閾値以降のデバイスに達したら打ち切る
         devices_to_remove = []
-        
-        for device_id, device in self.devices.items():
-            if device.last_seen < threshold:
-                devices_to_remove.append(device_id)
+        for device_id in self._by_last_seen:
+            if self.devices[device_id].last_seen >= threshold:
+                break
+            devices_to_remove.append(device_id)
                 
         # 削除実行
         for device_id in devices_to_remove:
             device = self.devices[device_id]
-            if device.mac_address in self.mac_to_id:
-                del self.mac_to_id[device.mac_address]
+            # 匿名化時はdevice.mac_addressが空のため逆引きインデックスから削除する
+            self.mac_to_id.pop(self.id_to_mac.pop(device_id, None), None)
             del self.devices[device_id]
+            self._forget(device)
             
         if devices_to_remove:
             self.logger.info(f"Cleaned up {len(devices_to_remove)} old devices")
@@ -413,24 +575,17 @@ class DeviceManager:
         """統計情報を取得"""
         active_devices = self.get_active_devices()
         
-        # ゾーン別統計
-        zone_stats = defaultdict(int)
-        for device in active_devices:
-            if device.current_zone:
-                zone_stats[device.current_zone] += 1
-                
-        # デバイスタイプ別統計
-        type_stats = defaultdict(int)
-        for device in active_devices:
-            type_stats[device.device_type] += 1
-            
+        # ゾーン別・デバイスタイプ別統計
+        zone_stats = Counter(device.current_zone for device in active_devices if device.current_zone)
+        type_stats = Counter(device.device_type for device in active_devices)
+        
         return {
             'total_devices': self.stats['total_devices'],
             'active_devices': len(active_devices),
             'new_devices_today': self.stats['new_devices_today'],
             'device_types': dict(type_stats),
             'zones': dict(zone_stats),
-            'avg_zones_visited': np.mean([len(d.zones_visited) for d in self.devices.values()]) if self.devices else 0,
+            'avg_zones_visited': self._total_zones_visited / len(self.devices) if self.devices else 0,
             'timestamp': datetime.now().isoformat()
         }
         
@@ -1,10 +1,10 @@
 """位置計算モジュール"""
+import heapq
 import logging
 import numpy as np
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 from scipy.optimize import minimize
-from scipy.spatial import distance
 
 
 @dataclass
@@ -17,9 +17,68 @@ class ReceiverMeasurement:
     timestamp: float
 
 
+def _polygon_edges(polygon: List[List[float]]) -> np.ndarray:
+    """
+    ポリゴンの頂点リストを辺の配列に変換
+    
+    Args:
+        polygon: ポリゴンの頂点リスト
+        
+    Returns:
+        各辺の (x1, y1, x2, y2) を並べた配列 (n, 4)
+    """
+    p1 = np.asarray(polygon, dtype=np.float64)
+    p2 = np.roll(p1, -1, axis=0)
+    return np.hstack([p1, p2])
+
+
+def _point_in_edges(x: float, y: float, edges: np.ndarray) -> bool:
+    """
+    レイキャスティング法で点がポリゴン内にあるか判定（全辺を一括で評価）
+    
+    Args:
+        x: 点のX座標
+        y: 点のY座標
+        edges: _polygon_edgesで作成した辺の配列
+        
+    Returns:
+        ポリゴン内にあるかどうか
+    """
+    x1, y1, x2, y2 = edges.T
+    # 点の高さをまたぐ辺（下端を含まず上端を含む）
+    crosses = (y1 < y) != (y2 < y)
+    if not crosses.any():
+        return False
+    x1, y1, x2, y2 = x1[crosses], y1[crosses], x2[crosses], y2[crosses]
+    xinters = (y - y1) * (x2 - x1) / (y2 - y1) + x1
+    return bool(np.count_nonzero(x <= xinters) % 2)
+
+
+def _is_axis_aligned_rect(edges: np.ndarray) -> bool:
+    """
+    ポリゴンが軸に平行な長方形か判定
+    
+    Args:
+        edges: _polygon_edgesで作成した辺の配列
+        
+    Returns:
+        軸に平行な長方形かどうか
+    """
+    if len(edges) != 4:
+        return False
+    x1, y1, x2, y2 = edges.T
+    # すべての辺が水平か垂直で、頂点が4つの異なる角になっている
+    axis_aligned = np.all((x1 == x2) ^ (y1 == y2))
+    corners = {(x, y) for x, y in edges[:, :2].tolist()}
+    return bool(axis_aligned) and len(corners) == 4 and len(set(x1)) == 2 and len(set(y1)) == 2
+
+
 class PositionCalculator:
     """位置計算クラス"""
     
+    # 変換テーブルで扱うRSSIの下限（BLEの最小値）
+    RSSI_MIN = -127
+    
     def __init__(self, config: Dict, layout: Dict):
         """
         初期化
@@ -43,12 +102,37 @@ class PositionCalculator:
         for receiver in layout.get('receivers', []):
             self.receiver_positions[receiver['id']] = tuple(receiver['position'])
             
+        # ゾーン判定用に各ポリゴンの辺と外接矩形 (min_x, min_y, max_x, max_y) を配列化しておく
+        zones = layout.get('zones', [])
+        self._zone_ids = [zone['id'] for zone in zones]
+        self._zone_edges = [_polygon_edges(zone['polygon']) for zone in zones]
+        self._zone_bboxes = np.array(
+            [[*edges[:, :2].min(axis=0), *edges[:, :2].max(axis=0)] for edges in self._zone_edges],
+            dtype=np.float64
+        ).reshape(-1, 4)
+        # 軸に平行な長方形のゾーンは外接矩形との比較だけで判定できる
+        self._zone_is_rect = [_is_axis_aligned_rect(edges) for edges in self._zone_edges]
+            
         # カルマンフィルタ用の状態
         self.kalman_states = {}
         
+        # カルマンフィルタの定数行列（呼び出しごとに作らない）
+        dt = 1.0  # 時間ステップ
+        self._kalman_F = np.array([  # 状態遷移行列
+            [1, 0, dt, 0],
+            [0, 1, 0, dt],
+            [0, 0, 1, 0],
+            [0, 0, 0, 1]
+        ], dtype=np.float64)
+        self._kalman_Q = np.eye(4) * 0.1  # プロセスノイズ
+        self._kalman_R = np.eye(2) * 1.0  # 観測ノイズ
+        
         # Path Loss Exponent (環境に応じて調整)
         self.path_loss_exponent = 2.5
         
+        # (送信電力, Path Loss Exponent) ごとのRSSI→距離変換テーブル
+        self._distance_tables: Dict[Tuple[int, float], List[float]] = {}
+        
     def calculate_position(self, measurements: List[ReceiverMeasurement]) -> Optional[Tuple[float, float]]:
         """
         複数の受信機の測定値から位置を計算
@@ -93,25 +177,45 @@ class PositionCalculator:
             return None
             
         # 最も強い信号の3つを使用
-        measurements = sorted(measurements, key=lambda m: m.rssi, reverse=True)[:3]
+        measurements = heapq.nlargest(3, measurements, key=lambda m: m.rssi)
+        
+        R = np.array([m.receiver_position for m in measurements], dtype=np.float64)
+        d = np.array([m.distance for m in measurements], dtype=np.float64)
+        
+        # 円の方程式から基準受信機の式を引いて線形化し、A @ pos = b を直接解く
+        A = 2 * (R[1:] - R[0])
+        b = (d[0] ** 2 - d[1:] ** 2) + (np.einsum('ij,ij->i', R[1:], R[1:]) - R[0] @ R[0])
+        
+        # 受信機が一直線上に並ぶ場合は解が定まらないため反復最適化に切り替える
+        if np.linalg.cond(A) < 1e8:
+            return tuple(np.linalg.solve(A, b))
+            
+        return self._optimize_position(R, d)
         
+    def _optimize_position(self, R: np.ndarray, d: np.ndarray) -> Optional[Tuple[float, float]]:
+        """
+        反復最適化による位置推定（線形化できない受信機配置用）
+        
+        Args:
+            R: 受信機位置の配列 (n, 2)
+            d: 測定距離の配列 (n,)
+            
+        Returns:
+            推定位置
+        """
         # 初期推定値（重心）
-        x0 = np.mean([m.receiver_position[0] for m in measurements])
-        y0 = np.mean([m.receiver_position[1] for m in measurements])
-        initial_guess = [x0, y0]
+        initial_guess = R.mean(axis=0)
         
-        # 最小二乗法で位置を推定
+        # 最小二乗法で位置を推定（誤差と解析的な勾配を同時に返す）
         def objective(pos):
-            x, y = pos
-            error = 0
-            for m in measurements:
-                rx, ry = m.receiver_position
-                predicted_distance = np.sqrt((x - rx)**2 + (y - ry)**2)
-                error += (predicted_distance - m.distance)**2
-            return error
+            diff = pos - R
+            pred = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+            e = pred - d
+            grad = 2 * ((e / np.maximum(pred, 1e-12))[:, None] * diff).sum(axis=0)
+            return e @ e, grad
             
         # 最適化
-        result = minimize(objective, initial_guess, method='L-BFGS-B')
+        result = minimize(objective, initial_guess, method='L-BFGS-B', jac=True)
         
         if result.success:
             return tuple(result.x)
@@ -173,40 +277,23 @@ class PositionCalculator:
             }
             
         state = self.kalman_states[device_id]
-        
-        # 状態遷移行列
-        dt = 1.0  # 時間ステップ
-        F = np.array([
-            [1, 0, dt, 0],
-            [0, 1, 0, dt],
-            [0, 0, 1, 0],
-            [0, 0, 0, 1]
-        ])
-        
-        # プロセスノイズ
-        Q = np.eye(4) * 0.1
+        F = self._kalman_F
         
         # 予測ステップ
         x_pred = F @ state['x']
-        P_pred = F @ state['P'] @ F.T + Q
-        
-        # 観測行列
-        H = np.array([[1, 0, 0, 0], [0, 1, 0, 0]])
-        
-        # 観測ノイズ
-        R = np.eye(2) * 1.0
+        P_pred = F @ state['P'] @ F.T + self._kalman_Q
         
         # 観測値
         z = np.array(initial_position)
         
-        # 更新ステップ
-        y = z - H @ x_pred  # 残差
-        S = H @ P_pred @ H.T + R  # 残差共分散
-        K = P_pred @ H.T @ np.linalg.inv(S)  # カルマンゲイン
+        # 更新ステップ（観測行列Hは位置成分を取り出すだけなので、行列積をスライスで置き換える）
+        y = z - x_pred[:2]  # 残差
+        S = P_pred[:2, :2] + self._kalman_R  # 残差共分散
+        K = np.linalg.solve(S, P_pred[:2, :]).T  # カルマンゲイン（Sは対称行列）
         
         # 状態更新
         state['x'] = x_pred + K @ y
-        state['P'] = (np.eye(4) - K @ H) @ P_pred
+        state['P'] = P_pred - K @ P_pred[:2, :]
         
         return (state['x'][0], state['x'][1])
         
@@ -224,13 +311,34 @@ class PositionCalculator:
         if rssi == 0:
             return self.max_distance
             
+        # 整数RSSIは送信電力ごとに作成した変換テーブルから引く
+        if type(rssi) is int and self.RSSI_MIN <= rssi < 0:
+            key = (tx_power, self.path_loss_exponent)
+            table = self._distance_tables.get(key)
+            if table is None:
+                table = self._distance_tables[key] = [
+                    self._path_loss_distance(r, tx_power) for r in range(self.RSSI_MIN, 0)
+                ]
+            return table[rssi - self.RSSI_MIN]
+            
+        return self._path_loss_distance(rssi, tx_power)
+        
+    def _path_loss_distance(self, rssi: float, tx_power: int) -> float:
+        """
+        パスロスモデルで距離を計算（最大距離でクリップ）
+        
+        Args:
+            rssi: 受信信号強度
+            tx_power: 送信電力（1メートルでのRSSI）
+            
+        Returns:
+            推定距離（メートル）
+        """
         # パスロスモデル
         distance = 10 ** ((tx_power - rssi) / (10 * self.path_loss_exponent))
         
         # 最大距離でクリップ
-        distance = min(distance, self.max_distance)
-        
-        return distance
+        return min(distance, self.max_distance)
         
     def _clip_to_facility(self, position: Tuple[float, float]) -> Tuple[float, float]:
         """
@@ -266,9 +374,19 @@ class PositionCalculator:
         """
         x, y = position
         
-        for zone in self.layout.get('zones', []):
-            if self._point_in_polygon(position, zone['polygon']):
-                return zone['id']
+        # 外接矩形に含まれるゾーンだけをポリゴン判定する
+        bboxes = self._zone_bboxes
+        candidates = np.flatnonzero(
+            (bboxes[:, 0] <= x) & (x <= bboxes[:, 2]) &
+            (bboxes[:, 1] <= y) & (y <= bboxes[:, 3])
+        )
+        for i in candidates:
+            if self._zone_is_rect[i]:
+                # レイキャスティングと同じく左辺・下辺は含まない
+                if x > bboxes[i, 0] and y > bboxes[i, 1]:
+                    return self._zone_ids[i]
+            elif _point_in_edges(x, y, self._zone_edges[i]):
+                return self._zone_ids[i]
                 
         return None
         
@@ -284,23 +402,7 @@ class PositionCalculator:
         Returns:
             ポリゴン内にあるかどうか
         """
-        x, y = point
-        n = len(polygon)
-        inside = False
-        
-        p1x, p1y = polygon[0]
-        for i in range(1, n + 1):
-            p2x, p2y = polygon[i % n]
-            if y > min(p1y, p2y):
-                if y <= max(p1y, p2y):
-                    if x <= max(p1x, p2x):
-                        if p1y != p2y:
-                            xinters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
-                        if p1x == p2x or x <= xinters:
-                            inside = not inside
-            p1x, p1y = p2x, p2y
-            
-        return inside
+        return _point_in_edges(point[0], point[1], _polygon_edges(polygon))
         
     def smooth_trajectory(self, positions: List[Tuple[float, float]], 
                          window_size: int = 5) -> List[Tuple[float, float]]:
@@ -317,18 +419,18 @@ class PositionCalculator:
         if len(positions) < window_size:
             return positions
             
-        positions_array = np.array(positions)
-        smoothed = []
+        positions_array = np.asarray(positions, dtype=np.float64)
+        n = len(positions_array)
+        half = window_size // 2
         
-        for i in range(len(positions)):
-            start = max(0, i - window_size // 2)
-            end = min(len(positions), i + window_size // 2 + 1)
-            
-            window = positions_array[start:end]
-            smoothed_point = np.mean(window, axis=0)
-            smoothed.append(tuple(smoothed_point))
-            
-        return smoothed
+        # 累積和の差で各ウィンドウの合計を一括計算（端ではウィンドウ内の点のみで平均する）
+        cumsum = np.vstack([np.zeros((1, 2)), np.cumsum(positions_array, axis=0)])
+        index = np.arange(n)
+        start = np.maximum(index - half, 0)
+        end = np.minimum(index + half + 1, n)
+        smoothed = (cumsum[end] - cumsum[start]) / (end - start)[:, None]
+        
+        return list(map(tuple, smoothed.tolist()))
         
     def calculate_speed(self, positions: List[Tuple[float, float]], 
                        timestamps: List[float]) -> List[float]:
@@ -345,19 +447,9 @@ class PositionCalculator:
         if len(positions) < 2:
             return []
             
-        speeds = []
+        # 隣接点間の距離と時間差をまとめて計算（時間差が0以下の区間は0とする）
+        dist = np.linalg.norm(np.diff(np.asarray(positions, dtype=np.float64), axis=0), axis=1)
+        time_diff = np.diff(np.asarray(timestamps, dtype=np.float64))
+        speeds = np.where(time_diff > 0, dist / np.where(time_diff > 0, time_diff, 1.0), 0.0)
         
-        for i in range(1, len(positions)):
-            # 距離計算
-            dist = distance.euclidean(positions[i-1], positions[i])
-            
-            # 時間差
-            time_diff = timestamps[i] - timestamps[i-1]
-            
-            if time_diff > 0:
-                speed = dist / time_diff
-                speeds.append(speed)
-            else:
-                speeds.append(0)
-                
-        return speeds
\ No newline at end of file
+        return speeds.tolist()
\ No newline at end of file
@@ -1,81 +1,135 @@
 """Bluetoothスキャナーモジュール"""
 import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+import sys
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+from datetime import datetime
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
 from dataclasses import dataclass, field
 
+import numpy as np
+
 from bleak import BleakScanner
 from bleak.backends.device import BLEDevice
 from bleak.backends.scanner import AdvertisementData
 
+# 信号強度カテゴリの境界（dBm）と、境界で区切った弱い順のカテゴリ（閾値より大きければ上のカテゴリ）
+_SIGNAL_THRESHOLDS = (-85, -70, -50)
+_SIGNAL_CATEGORIES = ("weak", "medium", "strong", "very_strong")
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class DetectedDevice:
-    """検出されたデバイス"""
+    """検出されたデバイス（生成後は変更しない）"""
     mac_address: str
     device_name: Optional[str]
     rssi: int
-    timestamp: datetime
+    timestamp: float  # 検知時刻（UNIXエポック秒）
     receiver_id: str
     raw_data: Optional[Dict] = None
     manufacturer_data: Optional[Dict] = None
     service_data: Optional[Dict] = None
     
+    @property
+    def timestamp_dt(self) -> datetime:
+        """検知時刻をdatetimeで返す"""
+        return datetime.fromtimestamp(self.timestamp)
+        
     @property
     def signal_strength(self) -> str:
         """信号強度のカテゴリを返す"""
-        if self.rssi > -50:
-            return "very_strong"
-        elif self.rssi > -70:
-            return "strong"
-        elif self.rssi > -85:
-            return "medium"
-        else:
-            return "weak"
+        return _SIGNAL_CATEGORIES[bisect_left(_SIGNAL_THRESHOLDS, self.rssi)]
 
 
 class BluetoothScanner:
     """Bluetoothデバイススキャナー"""
     
-    def __init__(self, config: Dict, receiver_id: str = "default"):
+    # Path Loss Exponent (環境による、通常2-4)
+    PATH_LOSS_EXPONENT = 2.5
+    
+    # 距離変換テーブルで扱うRSSIの下限（BLEの最小値）
+    RSSI_MIN = -127
+    
+    # スキャナーの起動に失敗した場合の再試行間隔（秒）
+    START_RETRY_DELAY = 5.0
+    
+    def __init__(self, config: Dict, receiver_id: str = "default",
+                 adapter: Optional[str] = None):
         """
         初期化
         
         Args:
             config: スキャン設定
             receiver_id: 受信機ID
+            adapter: 使用するBluetoothアダプタ（例: "hci1"、Noneの場合は既定のアダプタ）
         """
         self.config = config
-        self.receiver_id = receiver_id
+        self.receiver_id = sys.intern(receiver_id)
+        self.adapter = adapter
         self.logger = logging.getLogger(__name__)
         
         # スキャン設定
-        self.scan_interval = config.get('interval', 1.0)
-        self.scan_duration = config.get('duration', 5.0)
+        self.scan_interval = config.get('interval', 1.0)  # 定期処理（クリーンアップ）の間隔
         self.rssi_threshold = config.get('rssi_threshold', -90)
         self.device_timeout = config.get('device_timeout', 30.0)
         self.duplicate_detection_window = config.get('duplicate_detection_window', 10.0)  # 重複検知ウィンドウ
+        self.max_devices = config.get('max_devices', 4096)  # 保持するデバイス数の上限
         
-        # デバイスキャッシュ
+        # デバイスキャッシュ（detected_devices・_device_seen・recent_detectionsは検知した順に保持する）
+        # 期限切れの判定はシステム時刻の補正（NTPなど）で順序が崩れないようtime.monotonic()で行い、
+        # DetectedDevice.timestampには下流で使うシステム時刻（エポック秒）を保持する
         self.detected_devices: Dict[str, DetectedDevice] = {}
-        self.device_history: List[DetectedDevice] = []
-        self.recent_detections: Dict[str, datetime] = {}  # 最近の検知タイムスタンプ
+        self._device_seen: Dict[str, float] = {}  # デバイスごとの最終検知時刻（monotonic）
+        self.device_history: Deque[DetectedDevice] = deque(maxlen=1000)  # 直近1000件
+        self.recent_detections: Dict[str, float] = {}  # 最近の検知時刻（monotonic）
+        
+        # detected_devicesのRSSI集計（追加・削除のたびに更新し、統計取得時に全件を走査しない）
+        self._rssi_sum = 0
+        self._rssi_counts: Counter = Counter()  # RSSI値ごとのデバイス数
+        self._signal_counts = [0] * len(_SIGNAL_CATEGORIES)  # 信号強度カテゴリごとのデバイス数
+        
+        # 送信電力ごとのRSSI→距離変換テーブル
+        self._distance_tables: Dict[int, List[float]] = {}
         
         # スキャン状態
         self.is_scanning = False
         self.scanner = None
         self._scan_task = None
+        self._detected_since_tick = 0  # 前回の定期処理以降の検知数
         
     async def start(self) -> None:
-        """スキャン開始"""
+        """スキャン開始（スキャナーを起動したまま、検知はコールバックで受け取る）"""
         if self.is_scanning:
             self.logger.warning("Scanner is already running")
             return
             
         self.is_scanning = True
+        self._detected_since_tick = 0
+        # 起動に失敗した場合は定期処理ループで再試行する（アダプタの準備待ちなど）
+        await self._start_scanner()
         self._scan_task = asyncio.create_task(self._scan_loop())
+        
+    async def _start_scanner(self) -> bool:
+        """
+        BleakScannerを起動
+        
+        Returns:
+            起動できたかどうか
+        """
+        try:
+            # アダプタ指定はBlueZバックエンドでのみ有効
+            kwargs = {'adapter': self.adapter} if self.adapter else {}
+            self.scanner = BleakScanner(detection_callback=self._on_advertisement, **kwargs)
+            await self.scanner.start()
+        except Exception as e:
+            self.scanner = None
+            self.logger.error(f"Scan failed: {e} (retrying in {self.START_RETRY_DELAY}s)")
+            self.logger.error("Try running with administrator privileges on Windows")
+            return False
+            
         self.logger.info(f"Bluetooth scanner started (receiver: {self.receiver_id})")
+        return True
         
     async def stop(self) -> None:
         """スキャン停止"""
@@ -90,16 +144,36 @@ class BluetoothScanner:
                 
         if self.scanner:
             await self.scanner.stop()
+            self.scanner = None
             
         self.logger.info(f"Bluetooth scanner stopped (receiver: {self.receiver_id})")
         
     async def _scan_loop(self) -> None:
-        """スキャンループ"""
+        """定期処理ループ（スキャナーの起動再試行、検知状況の記録とタイムアウトしたデバイスのクリーンアップ）"""
         while self.is_scanning:
             try:
-                await self._perform_scan()
+                if self.scanner is None:
+                    # スキャナーが起動していなければ間隔を空けて起動を再試行
+                    await asyncio.sleep(self.START_RETRY_DELAY)
+                    if self.is_scanning:
+                        await self._start_scanner()
+                    continue
+                    
                 await asyncio.sleep(self.scan_interval)
                 
+                if not self.detected_devices:
+                    self.logger.warning(
+                        f"No devices detected. "
+                        f"Check: 1) Bluetooth is ON, 2) Devices are in range, "
+                        f"3) RSSI threshold ({self.rssi_threshold} dBm)"
+                    )
+                else:
+                    self.logger.info(
+                        f"Scan tick: {self._detected_since_tick} detections, "
+                        f"{len(self.detected_devices)} devices in range"
+                    )
+                self._detected_since_tick = 0
+                
                 # タイムアウトしたデバイスをクリーンアップ
                 self._cleanup_old_devices()
                 
@@ -107,109 +181,123 @@ class BluetoothScanner:
                 self.logger.error(f"Scan error: {e}")
                 await asyncio.sleep(5)  # エラー時は少し待つ
                 
-    async def _perform_scan(self) -> None:
-        """単一スキャンを実行"""
-        try:
-            self.logger.info(f"Starting BLE scan (duration: {self.scan_duration}s)")
-            
-            # BleakScannerでスキャン (test_bluetooth_foldio_style.pyと同じ方式)
-            devices = await BleakScanner.discover(timeout=self.scan_duration)
-            
-            current_time = datetime.now()
-            detected_count = 0
-            
-            # デバイスリストを処理
-            for device in devices:
-                # RSSIを取得（属性がない場合はデフォルト値）
-                rssi = device.rssi if hasattr(device, 'rssi') and device.rssi else -70
-                
-                # RSSI閾値チェック
-                if rssi < self.rssi_threshold:
-                    continue
-                
-                # デバイス名（Noneの場合は"Unknown"）
-                device_name = device.name if device.name else "Unknown Device"
-                
-                # 重複検知のチェック
-                mac_addr = device.address
-                if mac_addr in self.recent_detections:
-                    time_since_last = (current_time - self.recent_detections[mac_addr]).total_seconds()
-                    if time_since_last < self.duplicate_detection_window:
-                        # 短時間で同じデバイスを検知した場合はスキップ
-                        self.logger.debug(
-                            f"Skipping duplicate: {mac_addr} "
-                            f"(last seen {time_since_last:.1f}s ago)"
-                        )
-                        continue
-                
-                # デバイス情報を作成
-                detected_device = DetectedDevice(
-                    mac_address=device.address,
-                    device_name=device_name,
-                    rssi=rssi,
-                    timestamp=current_time,
-                    receiver_id=self.receiver_id,
-                    manufacturer_data={},
-                    service_data={}
-                )
-                
-                # キャッシュに保存
-                self.detected_devices[device.address] = detected_device
-                self.device_history.append(detected_device)
-                self.recent_detections[device.address] = current_time  # 最近の検知時刻を記録
-                detected_count += 1
-                
-                self.logger.info(
-                    f"Detected device: {device.address} "
-                    f"(RSSI: {rssi} dBm, Name: {device_name})"
-                )
+    def _on_advertisement(self, device: BLEDevice, advertisement_data: AdvertisementData) -> None:
+        """
+        アドバタイズ受信時のコールバック
+        
+        Args:
+            device: 検出したデバイス
+            advertisement_data: アドバタイズデータ
+        """
+        now = time.monotonic()
+        
+        # RSSIを取得（値がない場合はデフォルト値）
+        rssi = advertisement_data.rssi or -70
+        
+        # RSSI閾値チェック
+        if rssi < self.rssi_threshold:
+            return
             
-            if detected_count == 0:
-                self.logger.warning(
-                    f"No devices detected in this scan. "
-                    f"Check: 1) Bluetooth is ON, 2) Devices are in range, "
-                    f"3) RSSI threshold ({self.rssi_threshold} dBm)"
+        # デバイス名（Noneの場合は"Unknown"）
+        device_name = advertisement_data.local_name or device.name or "Unknown Device"
+        
+        # 重複検知のチェック
+        # MACアドレスはインターン化し、同じデバイスの検知ごとに別の文字列を保持しないようにする
+        mac_addr = sys.intern(device.address)
+        if mac_addr in self.recent_detections:
+            time_since_last = now - self.recent_detections[mac_addr]
+            if time_since_last < self.duplicate_detection_window:
+                # 短時間で同じデバイスを検知した場合はスキップ
+                # （アドバタイズごとに呼ばれるため、ログ文字列は出力時のみ組み立てる）
+                self.logger.debug(
+                    "Skipping duplicate: %s (last seen %.1fs ago)", mac_addr, time_since_last
                 )
-            else:
-                self.logger.info(f"Scan completed: {detected_count} devices detected")
+                return
                 
-        except Exception as e:
-            self.logger.error(f"Scan failed: {e}")
-            self.logger.error("Try running with administrator privileges on Windows")
+        # デバイス情報を作成
+        detected_device = DetectedDevice(
+            mac_address=mac_addr,
+            device_name=device_name,
+            rssi=rssi,
+            timestamp=time.time(),
+            receiver_id=self.receiver_id
+        )
+        
+        # キャッシュに保存（再検知したデバイスは末尾に移して検知時刻順を保つ）
+        previous = self.detected_devices.pop(mac_addr, None)
+        if previous is not None:
+            self._remove_from_stats(previous)
+        self.detected_devices[mac_addr] = detected_device
+        self._add_to_stats(detected_device)
+        self._device_seen.pop(mac_addr, None)
+        self._device_seen[mac_addr] = now
+        if len(self.detected_devices) > self.max_devices:
+            # 上限を超えたら最も長く検知されていないデバイスを追い出す（再検知時に再登録される）
+            oldest = next(iter(self.detected_devices))
+            self._remove_from_stats(self.detected_devices.pop(oldest))
+            del self._device_seen[oldest]
+        self.device_history.append(detected_device)
+        self.recent_detections.pop(mac_addr, None)
+        self.recent_detections[mac_addr] = now  # 最近の検知時刻を記録
+        self._detected_since_tick += 1
+        
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(
+                "Detected device: %s (RSSI: %d dBm, Name: %s)", mac_addr, rssi, device_name
+            )
             
+    def _add_to_stats(self, device: DetectedDevice) -> None:
+        """RSSI集計にデバイスを加える"""
+        self._rssi_sum += device.rssi
+        self._rssi_counts[device.rssi] += 1
+        self._signal_counts[bisect_left(_SIGNAL_THRESHOLDS, device.rssi)] += 1
+        
+    def _remove_from_stats(self, device: DetectedDevice) -> None:
+        """RSSI集計からデバイスを除く"""
+        self._rssi_sum -= device.rssi
+        remaining = self._rssi_counts[device.rssi] - 1
+        if remaining:
+            self._rssi_counts[device.rssi] = remaining
+        else:
+            del self._rssi_counts[device.rssi]
+        self._signal_counts[bisect_left(_SIGNAL_THRESHOLDS, device.rssi)] -= 1
+        
     def _cleanup_old_devices(self) -> None:
         """古いデバイス情報をクリーンアップ"""
-        current_time = datetime.now()
-        timeout_threshold = current_time - timedelta(seconds=self.device_timeout)
+        current_time = time.monotonic()
+        timeout_threshold = current_time - self.device_timeout
         
-        # タイムアウトしたデバイスを削除
-        expired_devices = [
-            mac for mac, device in self.detected_devices.items()
-            if device.timestamp < timeout_threshold
-        ]
+        # タイムアウトしたデバイスを削除（古い順にたどり、期限内のデバイスに達したら打ち切る）
+        expired_devices = []
+        for mac, seen in self._device_seen.items():
+            if seen >= timeout_threshold:
+                break
+            expired_devices.append(mac)
         
         for mac in expired_devices:
-            del self.detected_devices[mac]
-            self.logger.debug(f"Device timeout: {mac}")
+            del self._device_seen[mac]
+            self._remove_from_stats(self.detected_devices.pop(mac))
+            self.logger.debug("Device timeout: %s", mac)
             
         # 古い重複検知記録も削除
-        duplicate_threshold = current_time - timedelta(seconds=self.duplicate_detection_window * 2)
-        expired_recent = [
-            mac for mac, timestamp in self.recent_detections.items()
-            if timestamp < duplicate_threshold
-        ]
+        duplicate_threshold = current_time - self.duplicate_detection_window * 2
+        expired_recent = []
+        for mac, timestamp in self.recent_detections.items():
+            if timestamp >= duplicate_threshold:
+                break
+            expired_recent.append(mac)
         
         for mac in expired_recent:
             del self.recent_detections[mac]
             
-        # 履歴のサイズを制限（直近1000件）
-        if len(self.device_history) > 1000:
-            self.device_history = self.device_history[-1000:]
-            
     def get_current_devices(self) -> List[DetectedDevice]:
         """現在検出中のデバイスリストを取得"""
         return list(self.detected_devices.values())
         
+    def _iter_devices(self) -> Iterable[DetectedDevice]:
+        """検出中デバイスをリスト化せずに走査する（内部用）"""
+        return self.detected_devices.values()
+        
     def get_device_count(self) -> int:
         """現在検出中のデバイス数を取得"""
         return len(self.detected_devices)
@@ -229,14 +317,35 @@ class BluetoothScanner:
         Returns:
             推定距離（メートル）
         """
-        # Path Loss Exponent (環境による、通常2-4)
-        n = 2.5
-        
+        # 整数RSSIは送信電力ごとに作成した変換テーブルから引く
+        if type(rssi) is int and self.RSSI_MIN <= rssi <= 0:
+            table = self._distance_tables.get(tx_power)
+            if table is None:
+                table = self._distance_tables[tx_power] = self.estimate_distances(
+                    np.arange(self.RSSI_MIN, 1), tx_power
+                ).tolist()
+            return table[rssi - self.RSSI_MIN]
+            
         # 距離計算
-        distance = 10 ** ((tx_power - rssi) / (10 * n))
+        distance = 10 ** ((tx_power - rssi) / (10 * self.PATH_LOSS_EXPONENT))
         
         return round(distance, 2)
         
+    def estimate_distances(self, rssi_values: np.ndarray, tx_power: int = -59) -> np.ndarray:
+        """
+        複数のRSSIから距離をまとめて推定
+        
+        Args:
+            rssi_values: 受信信号強度の配列
+            tx_power: 送信電力（1メートルでのRSSI）
+            
+        Returns:
+            推定距離の配列（メートル）
+        """
+        rssi_values = np.asarray(rssi_values, dtype=np.float64)
+        distances = np.power(10.0, (tx_power - rssi_values) / (10 * self.PATH_LOSS_EXPONENT))
+        return np.round(distances, 2)
+        
     def get_zone_devices(self, zone_polygon: List[Tuple[float, float]]) -> List[DetectedDevice]:
         """
         特定ゾーン内のデバイスを取得
@@ -253,6 +362,10 @@ class BluetoothScanner:
     def clear_all_devices(self) -> None:
         """全デバイス情報をクリア"""
         self.detected_devices.clear()
+        self._device_seen.clear()
+        self._rssi_sum = 0
+        self._rssi_counts.clear()
+        self._signal_counts = [0] * len(_SIGNAL_CATEGORIES)
         self.device_history.clear()
         self.recent_detections.clear()
         self.logger.info("All device information cleared")
@@ -266,18 +379,17 @@ class BluetoothScanner:
                 'signal_distribution': {}
             }
             
-        rssi_values = [d.rssi for d in self.detected_devices.values()]
-        signal_dist = {}
-        
-        for device in self.detected_devices.values():
-            strength = device.signal_strength
-            signal_dist[strength] = signal_dist.get(strength, 0) + 1
+        # 集計はデバイスの追加・削除時に更新済み（min/maxはRSSI値の種類数だけ走査）
+        signal_dist = {
+            category: count
+            for category, count in zip(_SIGNAL_CATEGORIES, self._signal_counts) if count
+        }
             
         return {
             'total_devices': len(self.detected_devices),
-            'avg_rssi': sum(rssi_values) / len(rssi_values),
-            'min_rssi': min(rssi_values),
-            'max_rssi': max(rssi_values),
+            'avg_rssi': self._rssi_sum / len(self.detected_devices),
+            'min_rssi': min(self._rssi_counts),
+            'max_rssi': max(self._rssi_counts),
             'signal_distribution': signal_dist,
             'receiver_id': self.receiver_id
         }
@@ -286,6 +398,9 @@ class BluetoothScanner:
 class MultiReceiverScanner:
     """複数受信機対応スキャナー"""
     
+    # スキャナー起動の間隔（秒）。BlueZが連続したStartDiscoveryへの応答を落とすのを避ける
+    START_STAGGER = 0.4
+    
     def __init__(self, config: Dict, receiver_configs: List[Dict]):
         """
         初期化
@@ -301,16 +416,17 @@ class MultiReceiverScanner:
         # 各受信機用のスキャナーを作成
         for receiver_config in receiver_configs:
             receiver_id = receiver_config['id']
-            scanner = BluetoothScanner(config, receiver_id)
+            scanner = BluetoothScanner(config, receiver_id, receiver_config.get('adapter'))
             self.scanners[receiver_id] = scanner
             
     async def start_all(self) -> None:
         """全スキャナーを開始"""
-        tasks = []
-        for scanner in self.scanners.values():
-            tasks.append(scanner.start())
+        # 各スキャナーは起動後に常時スキャンするため、起動だけ間隔を空けて順に行う
+        for i, scanner in enumerate(self.scanners.values()):
+            if i:
+                await asyncio.sleep(self.START_STAGGER)
+            await scanner.start()
             
-        await asyncio.gather(*tasks)
         self.logger.info(f"Started {len(self.scanners)} scanners")
         
     async def stop_all(self) -> None:
@@ -332,14 +448,13 @@ class MultiReceiverScanner:
         
     def get_merged_devices(self) -> List[DetectedDevice]:
         """全受信機のデバイス情報をマージして取得"""
-        merged = {}
+        merged: Dict[str, DetectedDevice] = {}
         
         for scanner in self.scanners.values():
-            for device in scanner.get_current_devices():
-                mac = device.mac_address
-                
+            for device in scanner._iter_devices():
                 # より強い信号のデバイスを優先
-                if mac not in merged or device.rssi > merged[mac].rssi:
-                    merged[mac] = device
+                current = merged.get(device.mac_address)
+                if current is None or device.rssi > current.rssi:
+                    merged[device.mac_address] = device
                     
         return list(merged.values())
\ No newline at end of file
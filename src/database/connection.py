@@ -12,7 +12,7 @@ from sqlalchemy.ext.asyncio import (
     async_sessionmaker
 )
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import text, select
+from sqlalchemy import text, select, TextClause
 import asyncpg
 try:
     from redis import asyncio as aioredis
@@ -21,6 +21,12 @@ except ImportError:
 
 from src.database.models import Base
 
+# 接続確認用クエリ（ヘルスチェックで定期的に発行されるため使い回す）
+_HEALTH_CHECK_QUERY = text("SELECT 1")
+
+# TimescaleDBのハイパーテーブルに変換するテーブル（時間列はいずれもtimestamp）
+_HYPERTABLES = ('trajectory_points', 'detections', 'heatmap_data')
+
 
 class DatabaseConnection:
     """データベース接続管理クラス"""
@@ -43,13 +49,26 @@ class DatabaseConnection:
         self.redis: Optional[aioredis.Redis] = None
         
         # 接続プール設定
+        # オーバーフロー接続は返却のたびに閉じられ、高頻度の保存処理で接続の
+        # 確立・切断を繰り返すため、既定では上限数の接続をプールに常駐させる
         self.pool_config = config.get('pool', {})
-        self.pool_size = self.pool_config.get('min_size', 5)
-        self.max_overflow = self.pool_config.get('max_size', 20) - self.pool_size
+        self.pool_size = self.pool_config.get('size', self.pool_config.get('max_size', 25))
+        self.max_overflow = self.pool_config.get('max_overflow', 0)
+        # 一定時間を超えた接続は再接続（サーバー側のアイドル切断対策）
+        self.pool_recycle = self.pool_config.get('recycle', 300)
+        # チェックアウトごとの生存確認（SELECT 1）は1往復増えるため既定では無効。
+        # 切断済みの接続は最初のクエリがエラーとなり、その接続は破棄される
+        self.pool_pre_ping = self.pool_config.get('pre_ping', False)
+        # クエリのタイムアウト（秒）。VACUUMやインデックス作成などの保守処理
+        # （execute_autocommit）はプール外の接続で実行し、この制限を適用しない
+        self.command_timeout = self.pool_config.get('command_timeout', 10)
         
         # TimescaleDB設定
         self.timescale_enabled = config.get('timescale', {}).get('enabled', False)
         
+        # 生SQLの構築済みステートメント（同じクエリ文字列の再解析を避ける）
+        self._statement_cache: Dict[str, TextClause] = {}
+        
     async def connect(self):
         """データベースに接続"""
         try:
@@ -61,7 +80,9 @@ class DatabaseConnection:
                 db_url,
                 pool_size=self.pool_size,
                 max_overflow=self.max_overflow,
-                pool_pre_ping=True,
+                pool_recycle=self.pool_recycle,
+                pool_pre_ping=self.pool_pre_ping,
+                connect_args={'command_timeout': self.command_timeout},
                 echo=False
             )
             
@@ -73,8 +94,8 @@ class DatabaseConnection:
             )
             
             # データベース接続をテスト
-            async with self.engine.begin() as conn:
-                await conn.execute(text("SELECT 1"))
+            async with self.engine.connect() as conn:
+                await conn.execute(_HEALTH_CHECK_QUERY)
                 
             self.logger.info("データベースに接続しました")
             
@@ -99,15 +120,24 @@ class DatabaseConnection:
             await self.redis.close()
             self.logger.info("Redis接続を切断しました")
             
+    def _connection_params(self) -> Dict[str, Any]:
+        """接続パラメータを取得"""
+        return {
+            'host': self.config.get('host', 'localhost'),
+            'port': int(self.config.get('port', 5432)),
+            'database': self.config.get('name', 'motion_analysis'),
+            'user': self.config.get('user', 'admin'),
+            'password': self.config.get('password', '')
+        }
+        
     def _build_database_url(self) -> str:
         """データベースURLを構築"""
-        host = self.config.get('host', 'localhost')
-        port = self.config.get('port', 5432)
-        database = self.config.get('name', 'motion_analysis')
-        user = self.config.get('user', 'admin')
-        password = self.config.get('password', '')
+        params = self._connection_params()
         
-        return f"postgresql+asyncpg://{user}:{password}@{host}:{port}/{database}"
+        return (
+            f"postgresql+asyncpg://{params['user']}:{params['password']}"
+            f"@{params['host']}:{params['port']}/{params['database']}"
+        )
         
     async def _setup_timescaledb(self):
         """TimescaleDBをセットアップ"""
@@ -116,38 +146,22 @@ class DatabaseConnection:
                 # TimescaleDB拡張を有効化
                 await conn.execute(text("CREATE EXTENSION IF NOT EXISTS timescaledb"))
                 
-                # trajectory_pointsテーブルをハイパーテーブルに変換
+                # 既存のハイパーテーブルを1回のクエリでまとめて確認
                 result = await conn.execute(
-                    text("SELECT EXISTS (SELECT 1 FROM timescaledb_information.hypertables WHERE table_name = 'trajectory_points')")
+                    text(
+                        "SELECT hypertable_name FROM timescaledb_information.hypertables "
+                        "WHERE hypertable_schema = 'public' AND hypertable_name = ANY(:names)"
+                    ),
+                    {'names': list(_HYPERTABLES)}
                 )
-                exists = result.scalar()
+                existing = set(result.scalars().all())
                 
-                if not exists:
-                    await conn.execute(
-                        text("SELECT create_hypertable('trajectory_points', 'timestamp', if_not_exists => TRUE)")
-                    )
-                    
-                # detectionsテーブルをハイパーテーブルに変換
-                result = await conn.execute(
-                    text("SELECT EXISTS (SELECT 1 FROM timescaledb_information.hypertables WHERE table_name = 'detections')")
-                )
-                exists = result.scalar()
-                
-                if not exists:
-                    await conn.execute(
-                        text("SELECT create_hypertable('detections', 'timestamp', if_not_exists => TRUE)")
-                    )
-                    
-                # heatmap_dataテーブルをハイパーテーブルに変換
-                result = await conn.execute(
-                    text("SELECT EXISTS (SELECT 1 FROM timescaledb_information.hypertables WHERE table_name = 'heatmap_data')")
-                )
-                exists = result.scalar()
-                
-                if not exists:
-                    await conn.execute(
-                        text("SELECT create_hypertable('heatmap_data', 'timestamp', if_not_exists => TRUE)")
-                    )
+                # 未変換のテーブルをハイパーテーブルに変換
+                for table_name in _HYPERTABLES:
+                    if table_name not in existing:
+                        await conn.execute(
+                            text(f"SELECT create_hypertable('{table_name}', 'timestamp', if_not_exists => TRUE)")
+                        )
                     
                 # データ保持ポリシーを設定
                 retention_days = self.config.get('timescale', {}).get('retention_days', 90)
@@ -235,18 +249,45 @@ class DatabaseConnection:
             
         self.logger.info("データベーステーブルを削除しました")
         
+    def _statement(self, query: str) -> TextClause:
+        """クエリ文字列に対応するステートメントを取得（キャッシュ済みなら再利用）"""
+        statement = self._statement_cache.get(query)
+        if statement is None:
+            statement = self._statement_cache[query] = text(query)
+        return statement
+        
     async def execute_raw(self, query: str, params: Dict = None):
         """生のSQLクエリを実行"""
         async with self.get_session() as session:
-            result = await session.execute(text(query), params or {})
+            result = await session.execute(self._statement(query), params or {})
             return result
     
     async def execute_query(self, query: str, params: Dict = None):
         """クエリを実行して結果を取得"""
         async with self.get_session() as session:
-            result = await session.execute(text(query), params or {})
+            result = await session.execute(self._statement(query), params or {})
             return result.fetchall()
             
+    async def execute_autocommit(self, query: str):
+        """
+        トランザクション外でSQLを実行（VACUUMやCREATE INDEX CONCURRENTLYなどの保守処理用）
+        
+        長時間かかる処理がcommand_timeoutで中断されないよう（中断されたCONCURRENTLYの
+        インデックス作成は無効なインデックスを残す）、タイムアウトなしの専用接続で実行する
+        
+        Args:
+            query: 実行するSQL
+        """
+        if not self.engine:
+            raise RuntimeError("データベースが接続されていません")
+            
+        # asyncpgの接続はトランザクションを開始しない限り自動コミットで実行される
+        conn = await asyncpg.connect(**self._connection_params(), command_timeout=None)
+        try:
+            await conn.execute(query)
+        finally:
+            await conn.close()
+            
     async def health_check(self) -> Dict[str, Any]:
         """ヘルスチェック"""
         health = {
@@ -257,8 +298,9 @@ class DatabaseConnection:
         
         # PostgreSQL接続チェック
         try:
-            async with self.engine.begin() as conn:
-                result = await conn.execute(text("SELECT 1"))
+            # 読み取りのみのためコミット不要（engine.begin()を使わない）
+            async with self.engine.connect() as conn:
+                result = await conn.execute(_HEALTH_CHECK_QUERY)
                 health['database'] = result.scalar() == 1
         except Exception as e:
             self.logger.error(f"Database health check failed: {e}")
@@ -356,26 +398,27 @@ class DatabaseManager:
         
     async def _create_indexes(self):
         """追加のインデックスを作成"""
+        # 互いに独立したインデックスのため、CONCURRENTLY（トランザクション外で実行）で並行して作成
         indexes = [
-            "CREATE INDEX IF NOT EXISTS idx_device_active ON devices (last_seen DESC) WHERE last_seen > NOW() - INTERVAL '5 minutes'",
-            "CREATE INDEX IF NOT EXISTS idx_trajectory_recent ON trajectories (start_time DESC) WHERE start_time > NOW() - INTERVAL '1 day'",
-            "CREATE INDEX IF NOT EXISTS idx_dwell_active ON dwell_times (entry_time DESC) WHERE is_active = true",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_device_active ON devices (last_seen DESC) WHERE last_seen > NOW() - INTERVAL '5 minutes'",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_trajectory_recent ON trajectories (start_time DESC) WHERE start_time > NOW() - INTERVAL '1 day'",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_dwell_active ON dwell_times (entry_time DESC) WHERE is_active = true",
         ]
         
-        for index_sql in indexes:
-            try:
-                await self.connection.execute_raw(index_sql)
-            except Exception as e:
-                self.logger.warning(f"インデックス作成エラー: {e}")
+        results = await asyncio.gather(
+            *(self.connection.execute_autocommit(index_sql) for index_sql in indexes),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                self.logger.warning(f"インデックス作成エラー: {result}")
                 
     async def optimize_database(self):
         """データベースを最適化"""
         try:
-            # VACUUM ANALYZEを実行
-            await self.connection.execute_raw("VACUUM ANALYZE")
-            
-            # 統計情報を更新
-            await self.connection.execute_raw("ANALYZE")
+            # VACUUMはトランザクション内で実行できないため自動コミットで実行
+            # （ANALYZEオプションで統計情報も同時に更新される）
+            await self.connection.execute_autocommit("VACUUM (ANALYZE)")
             
             self.logger.info("データベースの最適化が完了しました")
             
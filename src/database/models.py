@@ -87,7 +87,7 @@ class Trajectory(Base):
     __tablename__ = 'trajectories'
     
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    device_id = Column(String(36), ForeignKey('devices.id'), index=True)
+    device_id = Column(String(36), ForeignKey('devices.id', ondelete='SET NULL'), index=True)
     start_time = Column(DateTime, index=True)
     end_time = Column(DateTime, index=True)
     total_distance = Column(Float)
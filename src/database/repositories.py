@@ -1,8 +1,9 @@
 """データベースリポジトリパターン実装"""
 import logging
-from typing import List, Optional, Dict, Any
+from contextlib import asynccontextmanager
+from typing import List, Optional, Dict, Any, AsyncIterator, Tuple
 from datetime import datetime, timedelta
-from sqlalchemy import select, update, delete, and_, or_, func
+from sqlalchemy import select, insert, update, delete, and_, or_, func
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
@@ -29,6 +30,30 @@ class BaseRepository:
         await self.session.rollback()
 
 
+class RepositoryFactory:
+    """
+    リクエストスコープに依存しないリポジトリ用セッションファクトリ
+
+    バックグラウンド処理ではDependsで注入されたセッションを保持し続けず、
+    処理段階ごとにscope()でプールから借りて即座に返却する
+    """
+
+    def __init__(self, db_connection):
+        """
+        初期化
+
+        Args:
+            db_connection: データベース接続（DatabaseConnection）
+        """
+        self.db_connection = db_connection
+
+    @asynccontextmanager
+    async def scope(self) -> AsyncIterator[AsyncSession]:
+        """プールからセッションを借り、ブロック終了時に返却する"""
+        async with self.db_connection.get_session() as session:
+            yield session
+
+
 class DeviceRepository(BaseRepository):
     """デバイスリポジトリ"""
     
@@ -81,6 +106,20 @@ class DeviceRepository(BaseRepository):
         )
         return result.scalars().all()
         
+    async def count_active_devices(self, minutes: int = None, seconds: int = None) -> int:
+        """アクティブなデバイス数を取得（行を転送せずSQL側で集計）"""
+        if seconds:
+            threshold = datetime.utcnow() - timedelta(seconds=seconds)
+        elif minutes:
+            threshold = datetime.utcnow() - timedelta(minutes=minutes)
+        else:
+            threshold = datetime.utcnow() - timedelta(seconds=30)
+        result = await self.session.execute(
+            select(func.count(func.distinct(Device.device_id)))
+            .where(Device.last_seen >= threshold)
+        )
+        return result.scalar() or 0
+        
     async def update_last_seen(self, device_id: str, timestamp: datetime):
         """最終検出時刻を更新"""
         await self.session.execute(
@@ -149,10 +188,13 @@ class TrajectoryRepository(BaseRepository):
         return trajectory
         
     async def add_points(self, trajectory_id: str, points: List[Dict]):
-        """軌跡ポイントを追加"""
-        for point_data in points:
-            point = TrajectoryPoint(trajectory_id=trajectory_id, **point_data)
-            self.session.add(point)
+        """軌跡ポイントを追加（Core INSERTのexecutemanyで一括挿入）"""
+        if not points:
+            return
+        await self.session.execute(
+            insert(TrajectoryPoint),
+            [{**point_data, 'trajectory_id': trajectory_id} for point_data in points]
+        )
         await self.commit()
         
     async def get_trajectory(self, trajectory_id: str) -> Optional[Trajectory]:
@@ -223,10 +265,10 @@ class DetectionRepository(BaseRepository):
         return detection
     
     async def bulk_create(self, detections: List[Dict]):
-        """検出情報を一括作成"""
-        for detection_data in detections:
-            detection = Detection(**detection_data)
-            self.session.add(detection)
+        """検出情報を一括作成（Core INSERTのexecutemanyで一括挿入）"""
+        if not detections:
+            return
+        await self.session.execute(insert(Detection), detections)
         await self.commit()
     
     async def get_device_detections(self, device_id: str,
@@ -367,6 +409,67 @@ class DwellTimeRepository(BaseRepository):
             'min_duration': float(row.min_duration or 0)
         }
     
+    async def get_zone_statistics_range(self, zone_ids: List[str],
+                                        start_date: datetime,
+                                        end_date: datetime) -> Dict[Tuple[datetime, str], Dict]:
+        """
+        期間内のゾーン統計を日別・ゾーン別にまとめて取得
+        
+        Args:
+            zone_ids: 対象ゾーンID
+            start_date: 開始日（この日の0時から）
+            end_date: 終了日（この日の0時まで、含まない）
+            
+        Returns:
+            (日付, ゾーンID) → 統計。記録のない組み合わせは0で埋める
+        """
+        start_of_range = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        end_of_range = end_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        day = func.date_trunc('day', DwellTime.entry_time).label('day')
+        
+        result = await self.session.execute(
+            select(
+                day,
+                DwellTime.zone_id,
+                func.count(DwellTime.id).label('total_visits'),
+                func.count(func.distinct(DwellTime.device_id)).label('unique_visitors'),
+                func.avg(DwellTime.duration_seconds).label('avg_duration'),
+                func.max(DwellTime.duration_seconds).label('max_duration'),
+                func.min(DwellTime.duration_seconds).label('min_duration')
+            )
+            .where(
+                and_(
+                    DwellTime.zone_id.in_(zone_ids),
+                    DwellTime.entry_time >= start_of_range,
+                    DwellTime.entry_time < end_of_range
+                )
+            )
+            .group_by(day, DwellTime.zone_id)
+        )
+        
+        stats = {}
+        current = start_of_range
+        while current < end_of_range:
+            for zone_id in zone_ids:
+                stats[(current, zone_id)] = {
+                    'total_visits': 0,
+                    'unique_visitors': 0,
+                    'avg_duration': 0.0,
+                    'max_duration': 0.0,
+                    'min_duration': 0.0
+                }
+            current += timedelta(days=1)
+        
+        for row in result:
+            stats[(row.day, row.zone_id)] = {
+                'total_visits': row.total_visits or 0,
+                'unique_visitors': row.unique_visitors or 0,
+                'avg_duration': float(row.avg_duration or 0),
+                'max_duration': float(row.max_duration or 0),
+                'min_duration': float(row.min_duration or 0)
+            }
+        return stats
+    
     async def get_device_dwells(self, device_id: str,
                                start_time: Optional[datetime] = None,
                                end_time: Optional[datetime] = None) -> List[DwellTime]:
@@ -399,13 +502,13 @@ class FlowRepository(BaseRepository):
     
     async def update_flow_matrix(self, from_zone: str, to_zone: str,
                                 timestamp: datetime):
-        """フロー行列を更新"""
+        """フロー行列を更新（既存行のUPDATE、なければINSERT）"""
         hour = timestamp.hour
         day_of_week = timestamp.weekday()
         
-        # 既存レコードを検索
+        # 既存レコードを読み込まずにSQL側で加算する
         result = await self.session.execute(
-            select(FlowMatrix)
+            update(FlowMatrix.__table__)
             .where(
                 and_(
                     FlowMatrix.from_zone_id == from_zone,
@@ -414,25 +517,24 @@ class FlowRepository(BaseRepository):
                     FlowMatrix.day_of_week == day_of_week
                 )
             )
+            .values(
+                transition_count=FlowMatrix.transition_count + 1,
+                timestamp=timestamp
+            )
         )
         
-        flow = result.scalar_one_or_none()
-        
-        if flow:
-            # 既存レコードを更新
-            flow.transition_count += 1
-            flow.timestamp = timestamp
-        else:
+        if result.rowcount == 0:
             # 新規レコードを作成
-            flow = FlowMatrix(
-                from_zone_id=from_zone,
-                to_zone_id=to_zone,
-                timestamp=timestamp,
-                hour=hour,
-                day_of_week=day_of_week,
-                transition_count=1
+            await self.session.execute(
+                insert(FlowMatrix.__table__).values(
+                    from_zone_id=from_zone,
+                    to_zone_id=to_zone,
+                    timestamp=timestamp,
+                    hour=hour,
+                    day_of_week=day_of_week,
+                    transition_count=1
+                )
             )
-            self.session.add(flow)
             
         await self.commit()
         
@@ -452,6 +554,74 @@ class FlowRepository(BaseRepository):
         )
         return result.scalars().all()
         
+    async def get_hourly_flow_totals(self, date: datetime) -> List[Dict]:
+        """指定日の時間帯別遷移数を取得（SQL側で集計）"""
+        start_of_day = date.replace(hour=0, minute=0, second=0, microsecond=0)
+        end_of_day = start_of_day + timedelta(days=1)
+        
+        result = await self.session.execute(
+            select(
+                FlowMatrix.hour,
+                func.sum(FlowMatrix.transition_count).label('total_count')
+            )
+            .where(
+                and_(
+                    FlowMatrix.timestamp >= start_of_day,
+                    FlowMatrix.timestamp < end_of_day
+                )
+            )
+            .group_by(FlowMatrix.hour)
+            .order_by(FlowMatrix.hour)
+        )
+        
+        return [
+            {
+                'hour': row.hour,
+                'count': row.total_count or 0
+            }
+            for row in result
+        ]
+        
+    async def get_hourly_flow_totals_range(self, start_date: datetime,
+                                           end_date: datetime) -> Dict[datetime, List[Dict]]:
+        """
+        期間内の時間帯別遷移数を日別にまとめて取得（SQL側で集計）
+        
+        Args:
+            start_date: 開始日（この日の0時から）
+            end_date: 終了日（この日の0時まで、含まない）
+            
+        Returns:
+            日付 → 時間帯別遷移数のリスト
+        """
+        start_of_range = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        end_of_range = end_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        day = func.date_trunc('day', FlowMatrix.timestamp).label('day')
+        
+        result = await self.session.execute(
+            select(
+                day,
+                FlowMatrix.hour,
+                func.sum(FlowMatrix.transition_count).label('total_count')
+            )
+            .where(
+                and_(
+                    FlowMatrix.timestamp >= start_of_range,
+                    FlowMatrix.timestamp < end_of_range
+                )
+            )
+            .group_by(day, FlowMatrix.hour)
+            .order_by(day, FlowMatrix.hour)
+        )
+        
+        totals: Dict[datetime, List[Dict]] = {}
+        for row in result:
+            totals.setdefault(row.day, []).append({
+                'hour': row.hour,
+                'count': row.total_count or 0
+            })
+        return totals
+        
     async def get_popular_paths(self, limit: int = 10) -> List[Dict]:
         """人気の移動経路を取得"""
         result = await self.session.execute(
@@ -479,10 +649,10 @@ class HeatmapRepository(BaseRepository):
     """ヒートマップリポジトリ"""
     
     async def save_heatmap_data(self, heatmap_data: List[Dict]):
-        """ヒートマップデータを保存"""
-        for data in heatmap_data:
-            heatmap = HeatmapData(**data)
-            self.session.add(heatmap)
+        """ヒートマップデータを保存（Core INSERTのexecutemanyで一括挿入）"""
+        if not heatmap_data:
+            return
+        await self.session.execute(insert(HeatmapData), heatmap_data)
         await self.commit()
         
     async def get_heatmap_data(self, timestamp: datetime,
@@ -602,6 +772,15 @@ class ReportRepository(BaseRepository):
         await self.commit()
         return report
         
+    async def update(self, report_id: str, update_data: Dict):
+        """レポート情報を更新"""
+        await self.session.execute(
+            update(Report)
+            .where(Report.id == report_id)
+            .values(**update_data)
+        )
+        await self.commit()
+        
     async def get_report(self, report_id: str) -> Optional[Report]:
         """レポートを取得"""
         result = await self.session.execute(
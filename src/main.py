@@ -263,7 +263,7 @@ class MotionAnalysisSystem:
                     receiver_position=receiver_pos,
                     rssi=device.rssi,
                     distance=self.position_calculator.rssi_to_distance(device.rssi),
-                    timestamp=device.timestamp.timestamp()
+                    timestamp=device.timestamp
                 )
                 
                 device_measurements[mac].append(measurement)
@@ -311,18 +311,12 @@ class MotionAnalysisSystem:
         # デバイスの総数を取得して均等に配置
         num_devices = len(devices)
         
-        for idx, device in enumerate(devices):
-            # デバイス登録（重複チェック付き）
-            new_device = self.device_manager.register_device(
-                mac_address=device.mac_address,
-                device_name=device.device_name,
-                rssi=device.rssi,
-                check_duplicate=True
-            )
-            
-            # デバイスIDを取得
-            device_id = self.device_manager._anonymize_mac(device.mac_address)
-            
+        # スキャン分のデバイスをまとめて登録（重複チェック付き）
+        device_ids = self.device_manager.register_devices(
+            [(device.mac_address, device.device_name, device.rssi) for device in devices]
+        )
+        
+        for idx, (device, device_id) in enumerate(zip(devices, device_ids)):
             # デバイスが存在しない場合はスキップ
             if device_id not in self.device_manager.devices:
                 continue
@@ -354,7 +348,7 @@ class MotionAnalysisSystem:
             
             # RSSIの変動を考慮して位置に若干のランダム性を追加
             # 時間経過とともに位置が少し変化するようにタイムスタンプも考慮
-            time_factor = (device.timestamp.timestamp() % 100) / 100.0
+            time_factor = (device.timestamp % 100) / 100.0
             angle_variation = math.sin(time_factor * 2 * math.pi) * 0.2  # ±0.2ラジアンの変動
             angle = (angle + angle_variation) % (2 * math.pi)
             
@@ -393,7 +387,6 @@ class MotionAnalysisSystem:
             
             # データベースにデバイスを保存/更新
             if self.data_integration and self.data_integration.is_connected:
-                # new_deviceがnot Noneの場合は新規デバイス、Noneの場合は既存デバイス
                 saved = await self.data_integration.save_device(
                     device_id=device_obj.device_id,
                     mac_address=device_obj.mac_address,
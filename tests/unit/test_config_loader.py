@@ -160,6 +160,42 @@ class TestConfigLoader:
             # 環境変数が見つからない場合は元の文字列のまま
             assert config['database']['host'] == '${DB_HOST}'
             assert config['database']['port'] == '${DB_PORT}'
+    
+    def test_get_and_id_lookup(self, temp_config_file, temp_layout_file):
+        """ドット区切りキーとID索引による取得テスト"""
+        with open(temp_config_file, 'r') as f:
+            config_data = yaml.safe_load(f)
+        
+        config_data['facility']['layout_file'] = temp_layout_file
+        
+        with open(temp_config_file, 'w') as f:
+            yaml.dump(config_data, f)
+        
+        loader = ConfigLoader(temp_config_file)
+        loader.load()
+        
+        assert loader.get('scanning.interval') == 5
+        assert loader.get('scanning') == {'interval': 5, 'duration': 4, 'rssi_threshold': -90}
+        assert loader.get('scanning.missing', 'default') == 'default'
+        assert loader.get_zone_by_id('zone1')['name'] == 'Zone 1'
+        assert loader.get_zone_by_id('unknown') is None
+        assert loader.get_receiver_by_id('rx1')['position'] == [5, 5]
+    
+    @patch.dict(os.environ, {'DB_HOST': 'db.local', 'DB_PORT': '5432', 'FLAG': 'True'})
+    def test_embedded_env_substitution(self):
+        """文字列に埋め込まれた環境変数・リスト要素の置換テスト"""
+        loader = ConfigLoader('unused.yaml')
+        config = {
+            'url': 'postgresql://${DB_HOST}:${DB_PORT}/db',
+            'ports': ['${DB_PORT}', '${UNDEFINED_VAR}'],
+            'nested': {'enabled': '${FLAG}', 'name': 'plain'}
+        }
+        
+        loader._substitute_env_vars(config)
+        
+        assert config['url'] == 'postgresql://db.local:5432/db'
+        assert config['ports'] == [5432, '${UNDEFINED_VAR}']
+        assert config['nested'] == {'enabled': True, 'name': 'plain'}
 
 
 if __name__ == "__main__":
@@ -8,7 +8,7 @@ from unittest.mock import MagicMock, patch
 import sys
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
-from src.core.device_manager import DeviceManager, Device
+from src.core.device_manager import DeviceManager, Device, PositionHistory
 
 
 class TestDeviceManager:
@@ -245,5 +245,64 @@ class TestDeviceManager:
         assert device.rssi == -61
 
 
+class TestPositionHistory:
+    """PositionHistoryのテストクラス"""
+    
+    def test_ring_buffer_overwrites_oldest(self):
+        """上限を超えると古い位置から上書きされるテスト"""
+        history = PositionHistory(capacity=3)
+        start = datetime(2024, 1, 1, 12, 0, 0)
+        
+        for i in range(5):
+            history.append((start + timedelta(seconds=i), (float(i), float(i * 2))))
+        
+        assert len(history) == 3
+        assert history[0] == (start + timedelta(seconds=2), (2.0, 4.0))
+        assert history[-1] == (start + timedelta(seconds=4), (4.0, 8.0))
+        assert [p for _, p in history] == [(2.0, 4.0), (3.0, 6.0), (4.0, 8.0)]
+    
+    def test_between(self):
+        """時間範囲による絞り込みテスト"""
+        history = PositionHistory()
+        start = datetime(2024, 1, 1, 12, 0, 0)
+        
+        for i in range(10):
+            history.append((start + timedelta(seconds=i), (float(i), 0.0)))
+        
+        result = history.between(start + timedelta(seconds=3), start + timedelta(seconds=5))
+        
+        assert [t for t, _ in result] == [start + timedelta(seconds=i) for i in (3, 4, 5)]
+        assert PositionHistory().between() == []
+
+
+class TestRegisterDevices:
+    """DeviceManager.register_devicesのテストクラス"""
+    
+    def test_matches_individual_registration(self):
+        """一括登録が1件ずつの登録と同じ結果になるテスト"""
+        batch = [
+            ("AA:BB:CC:DD:EE:FF", None, -60),
+            ("11:22:33:44:55:66", "Galaxy Watch", -70),
+            ("AA:BB:CC:DD:EE:FF", "iPhone", -65),
+        ]
+        individual = DeviceManager({})
+        batched = DeviceManager({})
+        
+        for _ in range(2):
+            individual.start_new_scan()
+            batched.start_new_scan()
+            for mac, name, rssi in batch:
+                individual.register_device(mac, name, rssi)
+            device_ids = batched.register_devices(batch)
+        
+        assert device_ids == [individual._anonymize_mac(mac) for mac, _, _ in batch]
+        assert batched.current_scan_devices == individual.current_scan_devices
+        for device_id, device in individual.devices.items():
+            other = batched.devices[device_id]
+            assert other.total_detections == device.total_detections
+            assert other.device_name == device.device_name
+            assert other.device_type == device.device_type
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file
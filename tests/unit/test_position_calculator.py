@@ -243,5 +243,38 @@ class TestPositionCalculator:
         # 信頼度が低い場合でも位置は返す（フォールバック）
 
 
+class TestTrilateration:
+    """三辺測量のテストクラス"""
+    
+    @staticmethod
+    def _measurements(receivers, target):
+        """目標位置までの正確な距離を持つ測定値を作成"""
+        return [
+            ReceiverMeasurement(f'rx{i}', rx, -60, float(np.hypot(rx[0] - target[0], rx[1] - target[1])), 0.0)
+            for i, rx in enumerate(receivers)
+        ]
+    
+    def test_closed_form_solution(self):
+        """線形化した連立方程式で位置が求まるテスト"""
+        calculator = PositionCalculator({}, {'receivers': []})
+        measurements = self._measurements([(0, 0), (10, 0), (5, 10)], (3.0, 4.0))
+        
+        x, y = calculator._trilateration(measurements)
+        
+        assert x == pytest.approx(3.0)
+        assert y == pytest.approx(4.0)
+    
+    def test_collinear_receivers_fall_back_to_optimization(self):
+        """受信機が一直線上の場合は反復最適化にフォールバックするテスト"""
+        calculator = PositionCalculator({}, {'receivers': []})
+        measurements = self._measurements([(0, 0), (5, 0), (10, 0)], (3.0, 4.0))
+        
+        with patch.object(calculator, '_optimize_position', wraps=calculator._optimize_position) as optimize:
+            position = calculator._trilateration(measurements)
+        
+        optimize.assert_called_once()
+        assert position is not None
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file